@@ -1,6 +1,19 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, make_response, Response, g
 from flask_cors import CORS
 import sqlite3
+import base64
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from database import get_pool, pool_metrics
+from jobs import JobRunner
+from metrics import registry
 from datetime import datetime
 
 app = Flask(__name__)
@@ -8,54 +21,414 @@ CORS(app)  # Autorise React à appeler l'API
 
 DB_PATH = "maintenance.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+@app.before_request
+def start_timer():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def record_request(resp):
+    # Libellé = route déclarée (et non l'URL) pour garder un nombre de séries borné
+    if 't0' in g:
+        route = request.url_rule.rule if request.url_rule else 'inconnue'
+        registry.observe('http_request_seconds', time.perf_counter() - g.t0, methode=request.method, route=route)
+        registry.inc('http_requests_total', methode=request.method, route=route, code=resp.status_code)
+    return resp
+
+def get_db_pool():
+    # Connexions en lecture seule, mutualisées entre les requêtes (WAL : jamais bloquées par un import)
+    return get_pool(DB_PATH, readonly=True)
+
+# =============================================================================
+# Cache des réponses en lecture, invalidé par la génération des données
+# =============================================================================
+CACHE_MAX_ENTRIES = 256
+# Borne en octets (corps + version gzip) : un planning annuel complet pèse plusieurs Mo
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+COMPRESSION_MIN_BYTES = 1024
+
+def current_generation():
+    try:
+        row = get_db_pool().fetchone("SELECT generation FROM Data_Generation WHERE id = 1")
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        # Base antérieure à la table Data_Generation : pas de cache possible
+        return None
+
+class CachedResponse:
+    def __init__(self, body: bytes, mimetype: str):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.gzip_body = gzip.compress(body, 6) if len(body) >= COMPRESSION_MIN_BYTES else None
+        self.taille = len(body) + len(self.gzip_body or b'')
+
+    def respond(self):
+        compresse = self.gzip_body is not None and 'gzip' in request.accept_encodings
+        # ETag fort distinct par encodage, conformément à RFC 9110
+        etag = f"{self.etag}-gz" if compresse else self.etag
+        if request.if_none_match.contains(self.etag) or request.if_none_match.contains(f"{self.etag}-gz"):
+            resp = Response(status=304)
+        else:
+            resp = Response(self.gzip_body if compresse else self.body, mimetype=self.mimetype)
+            if compresse:
+                resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.vary.add('Accept-Encoding')
+        return resp
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 max_entry_bytes: int = CACHE_MAX_ENTRY_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.taille = 0
+        self.lock = threading.Lock()
+
+    def get(self, cle, generation):
+        with self.lock:
+            entree = self.entries.get(cle)
+            if entree is None or entree[0] != generation:
+                return None
+            self.entries.move_to_end(cle)
+            return entree[1]
+
+    def put(self, cle, generation, reponse: CachedResponse):
+        # Réponse trop volumineuse : servie sans être conservée
+        if reponse.taille > self.max_entry_bytes:
+            return
+        with self.lock:
+            ancienne = self.entries.pop(cle, None)
+            if ancienne is not None:
+                self.taille -= ancienne[1].taille
+            self.entries[cle] = (generation, reponse)
+            self.taille += reponse.taille
+            while len(self.entries) > self.max_entries or self.taille > self.max_bytes:
+                _, (_, evincee) = self.entries.popitem(last=False)
+                self.taille -= evincee.taille
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.taille = 0
+
+response_cache = ResponseCache()
+
+def cached_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = current_generation()
+        if generation is None:
+            return view(*args, **kwargs)
+        cle = (request.path, tuple(sorted(request.args.items(multi=True))))
+        reponse = response_cache.get(cle, generation)
+        if reponse is None:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+            reponse = CachedResponse(resp.get_data(), resp.mimetype)
+            response_cache.put(cle, generation, reponse)
+        return reponse.respond()
+    return wrapper
 
 @app.route('/api/matricules')
+@cached_response
 def get_matricules():
-    conn = get_db_connection()
-    matricules = conn.execute('SELECT * FROM Matricules').fetchall()
-    conn.close()
+    matricules = get_db_pool().fetchall('SELECT * FROM Matricules')
     return jsonify([dict(row) for row in matricules])
 
+TYPES_PLANNING = {'Controle': 'C', 'Nettoyage': 'N', 'Changement': 'CH'}
+STATUTS_PLANNING = ('a_faire', 'realise', 'annule_curatif', 'reporte')
+PAGE_DEFAUT = 200
+PAGE_MAX = 2000
+
+def parse_date(valeur):
+    return datetime.strptime(valeur, '%Y-%m-%d').date().isoformat()
+
+def encode_cursor(row):
+    cle = [row['date_prevue'], row['type_intervention'], row['matricule'], row['id']]
+    return base64.urlsafe_b64encode(json.dumps(cle).encode()).decode()
+
+def decode_cursor(valeur):
+    cle = json.loads(base64.urlsafe_b64decode(valeur.encode()))
+    # [date_prevue, type_intervention, matricule, id] : tout autre contenu est un curseur invalide (400)
+    if not isinstance(cle, list) or len(cle) != 4 or not all(isinstance(v, str) for v in cle[:3]) \
+            or not isinstance(cle[3], int) or isinstance(cle[3], bool):
+        raise ValueError(valeur)
+    return cle
+
+def planning_filters(date_debut=None, date_fin=None, matricule=None, type_interv=None, statut=None):
+    # Bornes semi-ouvertes [from, to) sur date_prevue : parcours par plage de l'index idx_planning_date
+    conditions, params = [], []
+    if date_debut:
+        conditions.append("date_prevue >= ?")
+        params.append(date_debut)
+    if date_fin:
+        conditions.append("date_prevue < ?")
+        params.append(date_fin)
+    if matricule:
+        # Préfixe exprimé en plage [prefixe, prefixe suivant) : utilisable par idx_planning_matricule, contrairement à LIKE
+        conditions.append("matricule >= ? AND matricule < ?")
+        params.extend((matricule, matricule[:-1] + chr(ord(matricule[-1]) + 1)))
+    if type_interv:
+        conditions.append("type_intervention = ?")
+        params.append(type_interv)
+    if statut:
+        conditions.append("statut = ?")
+        params.append(statut)
+    return conditions, params
+
+def planning_index(matricule):
+    # Préfixe sélectif (au plus √parc matricules) : lecture de ses seules lignes via idx_planning_matricule puis tri,
+    # sinon parcours de idx_planning_date dans l'ordre de pagination, vite interrompu par la limite
+    if not matricule:
+        return ""
+    pool = get_db_pool()
+    parc = pool.fetchone("SELECT COUNT(*) FROM Matricules")[0]
+    _, (debut, fin) = planning_filters(matricule=matricule)
+    retenus = pool.fetchone("SELECT COUNT(*) FROM Matricules WHERE matricule >= ? AND matricule < ?", (debut, fin))[0]
+    return "INDEXED BY idx_planning_matricule" if retenus * retenus <= parc else ""
+
+def query_planning(date_debut=None, date_fin=None, matricule=None, type_interv=None, statut=None,
+                   apres=None, limite=None):
+    conditions, params = planning_filters(date_debut, date_fin, matricule, type_interv, statut)
+    if apres:
+        # Pagination par clé (keyset) : reprise juste après la dernière ligne renvoyée, sans OFFSET
+        # (la borne date_prevue >= ? redondante permet à SQLite de démarrer le parcours d'index à la bonne date)
+        conditions.append("date_prevue >= ? AND (date_prevue, type_intervention, matricule, id) > (?, ?, ?, ?)")
+        params.append(apres[0])
+        params.extend(apres)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""
+        SELECT id, type_intervention,
+               CASE type_intervention WHEN 'C' THEN 'Controle' WHEN 'N' THEN 'Nettoyage' ELSE 'Changement' END AS type,
+               matricule, nom_entretien, date_prevue, statut, observations
+        FROM Planning {planning_index(matricule)}
+        {where}
+        ORDER BY date_prevue, type_intervention, matricule, id
+    """
+    if limite:
+        sql += " LIMIT ?"
+        params.append(limite)
+    return get_db_pool().fetchall(sql, params)
+
+def count_planning(**filtres):
+    conditions, params = planning_filters(**filtres)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return get_db_pool().fetchone(f"SELECT COUNT(*) FROM Planning {where}", params)[0]
+
+def planning_item(row):
+    return {k: row[k] for k in ('type', 'matricule', 'nom_entretien', 'date_prevue', 'statut', 'observations')}
+
 @app.route('/api/planning/<int:annee>')
+@cached_response
 def get_planning(annee):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Union des 3 tables de planning
-    cursor.execute(f"""
-        SELECT 'Controle' as type, matricule, nom_entretien, date_prevue, statut 
-        FROM Planning_Controle 
-        WHERE strftime('%Y', date_prevue) = ?
-        UNION ALL
-        SELECT 'Nettoyage', matricule, nom_entretien, date_prevue, statut 
-        FROM Planning_Nettoyage 
-        WHERE strftime('%Y', date_prevue) = ?
-        UNION ALL
-        SELECT 'Changement', matricule, nom_entretien, date_prevue, statut 
-        FROM Planning_Changement 
-        WHERE strftime('%Y', date_prevue) = ?
-        ORDER BY date_prevue
-    """, (str(annee), str(annee), str(annee)))
-    
-    planning = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(planning)
+    return jsonify([planning_item(row) for row in query_planning(f"{annee:04d}-01-01", f"{annee + 1:04d}-01-01")])
+
+@app.route('/api/planning')
+@cached_response
+def get_planning_page():
+    args = request.args
+    try:
+        filtres = {
+            'date_debut': parse_date(args['from']) if args.get('from') else None,
+            'date_fin': parse_date(args['to']) if args.get('to') else None,
+            'matricule': args.get('matricule', '').strip() or None,
+            'type_interv': TYPES_PLANNING[args['type']] if args.get('type') else None,
+            'statut': args.get('statut') or None,
+        }
+        if filtres['statut'] and filtres['statut'] not in STATUTS_PLANNING:
+            raise ValueError(filtres['statut'])
+        limite = min(max(int(args.get('limit', PAGE_DEFAUT)), 1), PAGE_MAX)
+        apres = decode_cursor(args['cursor']) if args.get('cursor') else None
+    except (KeyError, ValueError, TypeError):
+        return jsonify({'error': "Paramètres invalides (from/to AAAA-MM-JJ, type, statut, limit, cursor)"}), 400
+    # Une ligne de plus que la page pour savoir s'il existe une suite
+    rows = query_planning(apres=apres, limite=limite + 1, **filtres)
+    suite = len(rows) > limite
+    rows = rows[:limite]
+    return jsonify({
+        'items': [planning_item(row) for row in rows],
+        'total': count_planning(**filtres) if not apres else None,
+        'next_cursor': encode_cursor(rows[-1]) if suite else None,
+    })
+
+KPI_DIMENSIONS = ('matricule', 'categorie', 'mois', 'type_panne')
+
+@app.route('/api/kpis')
+@cached_response
+def get_kpis():
+    # Lecture des agrégats précalculés : coût borné par la taille du parc et le nombre de mois, pas par l'historique
+    args = request.args
+    dimensions = [d.strip() for d in args.get('par', 'categorie,mois').split(',') if d.strip()]
+    if not dimensions or any(d not in KPI_DIMENSIONS for d in dimensions):
+        return jsonify({'error': f"Paramètre 'par' attendu parmi : {', '.join(KPI_DIMENSIONS)}"}), 400
+    conditions, params = [], []
+    for nom in ('matricule', 'categorie'):
+        if args.get(nom):
+            conditions.append(f"{nom} = ?")
+            params.append(args[nom])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    colonnes = ', '.join(dimensions)
+    indisponibilite = get_db_pool().fetchall(f"""
+        SELECT {colonnes}, SUM(nb_pannes) AS nb_pannes, SUM(jours_indisponibilite) AS jours_indisponibilite
+        FROM KPI_Indisponibilite
+        {where}
+        GROUP BY {colonnes}
+        ORDER BY {colonnes}
+    """, params)
+    # MTTR : jours d'indisponibilité par panne ; MTBF : jours entre la première et la dernière entrée en atelier
+    # rapportés au nombre d'intervalles entre pannes datées
+    fiabilite = get_db_pool().fetchall(f"""
+        SELECT matricule, categorie, nb_pannes, jours_indisponibilite, premiere_panne, derniere_panne,
+               ROUND(1.0 * jours_indisponibilite / nb_pannes, 2) AS mttr_jours,
+               CASE WHEN nb_pannes_datees > 1
+                    THEN ROUND((julianday(derniere_panne) - julianday(premiere_panne)) / (nb_pannes_datees - 1), 2)
+               END AS mtbf_jours
+        FROM KPI_Fiabilite
+        {where}
+        ORDER BY matricule
+    """, params)
+    return jsonify({
+        'indisponibilite': [dict(row) for row in indisponibilite],
+        'fiabilite': [dict(row) for row in fiabilite],
+    })
+
+RECHERCHE_DEFAUT = 20
+RECHERCHE_MAX = 100
+
+def fts_query(texte: str):
+    # Chaque mot devient un préfixe entre guillemets (aucune syntaxe FTS5 transmise telle quelle), tous requis
+    mots = re.findall(r"\w+", texte)
+    return ' '.join(f'"{mot}"*' for mot in mots) if mots else None
+
+@app.route('/api/search')
+@cached_response
+def search():
+    requete = fts_query(request.args.get('q', ''))
+    try:
+        limite = min(max(int(request.args.get('limit', RECHERCHE_DEFAUT)), 1), RECHERCHE_MAX)
+    except ValueError:
+        limite = None
+    if requete is None or limite is None:
+        return jsonify({'error': "Paramètres invalides (q requis, limit entier)"}), 400
+    # bm25 : score négatif, les meilleurs résultats en premier
+    matricules = get_db_pool().fetchall("""
+        SELECT m.matricule, m.designation, m.marque, m.code_barre, m.categorie, ROUND(bm25(Recherche_Matricules), 3) AS score
+        FROM Recherche_Matricules JOIN Matricules m ON m.rowid = Recherche_Matricules.rowid
+        WHERE Recherche_Matricules MATCH ?
+        ORDER BY bm25(Recherche_Matricules)
+        LIMIT ?
+    """, (requete, limite))
+    curatif = get_db_pool().fetchall("""
+        SELECT h.id, h.matricule, h.designation, h.date_entree, h.date_sortie, h.type_panne,
+               h.panne_declaree, h.pieces, ROUND(bm25(Recherche_Curatif), 3) AS score,
+               snippet(Recherche_Curatif, -1, '[', ']', '…', 10) AS extrait
+        FROM Recherche_Curatif JOIN Historique_Curatif h ON h.id = Recherche_Curatif.rowid
+        WHERE Recherche_Curatif MATCH ?
+        ORDER BY bm25(Recherche_Curatif)
+        LIMIT ?
+    """, (requete, limite))
+    return jsonify({
+        'matricules': [dict(row) for row in matricules],
+        'curatif': [dict(row) for row in curatif],
+    })
 
 @app.route('/api/sync-status')
+@cached_response
 def sync_status():
-    conn = get_db_connection()
-    logs = conn.execute("""
-        SELECT type_sync, dernier_nbsi, date_sync, nb_lignes_ajoutees, statut 
+    logs = get_db_pool().fetchall("""
+        SELECT type_sync, dernier_nbsi, date_sync, nb_lignes_ajoutees, statut, durees
         FROM Sync_Log 
         ORDER BY date_sync DESC LIMIT 5
-    """).fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in logs])
+    """)
+    return jsonify([{**dict(row), 'durees': json.loads(row['durees']) if row['durees'] else None} for row in logs])
+
+# =============================================================================
+# Jobs d'arrière-plan
+# =============================================================================
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+def get_job_runner():
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner(DB_PATH)
+        return _job_runner
+
+def parse_bool(valeur, defaut: bool) -> bool:
+    if valeur is None:
+        return defaut
+    if isinstance(valeur, bool):
+        return valeur
+    return str(valeur).strip().lower() in ('1', 'true', 'oui', 'yes')
+
+def job_param(nom: str):
+    corps = request.get_json(silent=True) or {}
+    return corps.get(nom, request.args.get(nom))
+
+def job_accepted(job, nouveau: bool):
+    resp = jsonify({**job.to_dict(), 'fusionne': not nouveau})
+    resp.status_code = 202
+    resp.headers['Location'] = f"/api/jobs/{job.id}"
+    return resp
+
+@app.route('/api/jobs/import', methods=['POST'])
+def submit_import_job():
+    job, nouveau = get_job_runner().submit_import(incremental=parse_bool(job_param('incremental'), True))
+    return job_accepted(job, nouveau)
+
+@app.route('/api/jobs/planning/<int:annee>', methods=['POST'])
+def submit_planning_job(annee):
+    try:
+        annee_fin = int(job_param('fin')) if job_param('fin') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': "Paramètre 'fin' attendu : année de fin d'horizon"}), 400
+    job, nouveau = get_job_runner().submit_planning(annee, incremental=parse_bool(job_param('incremental'), False),
+                                                    annee_fin=annee_fin)
+    return job_accepted(job, nouveau)
+
+@app.route('/api/jobs')
+def list_jobs():
+    return jsonify(get_job_runner().list())
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({'error': f"Job inconnu : {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({'error': f"Job inconnu : {job_id}"}), 404
+    depuis = request.headers.get('Last-Event-ID', type=int) or 0
+    resp = Response(job.stream(depuis), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+@app.route('/api/db-metrics')
+def db_metrics():
+    return jsonify(pool_metrics())
+
+@app.route('/api/metrics')
+def metrics():
+    # Format texte Prometheus : compteurs et histogrammes du processus, plus l'état des pools et du cache
+    for pool, stats in pool_metrics().items():
+        for nom, valeur in stats.items():
+            if isinstance(valeur, (int, float)) and not isinstance(valeur, bool):
+                registry.set_gauge(f"db_pool_{nom}", valeur, pool=pool)
+    registry.set_gauge('response_cache_entries', len(response_cache.entries))
+    registry.set_gauge('response_cache_bytes', response_cache.taille)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     print("API Flask lancée sur http://0.0.0.0:5000")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
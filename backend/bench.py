@@ -0,0 +1,300 @@
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from maintenance import DATA_DIR, Database, PlanningGenerator, run_import
+
+# =============================================================================
+# 1. GÉNÉRATION D'UN PARC SYNTHÉTIQUE
+# =============================================================================
+# Mêmes fichiers que l'export Excel : cp1252, séparateur ';', fins de ligne CRLF, dates JJ/MM/AAAA
+ENTETE_MATRICE = ['MATRICULE', 'DESIGNATION', 'ANNEE', 'QTE VIDANGE', 'CODE BARRE', 'MARQUE', 'PNEUMATIQUE', 'CATEGORIE']
+ENTETE_VIDANGE = ['NB.SI', 'V', 'STK', 'DESIGNATION', 'MATRICULE', 'DATE', 'PREVISION', ' COMPTEUR KM/H ', 'TYPE DE HUILE',
+                  ' QTE ', 'F/H', 'F/G', 'F/AIR', 'F/HYD', 'GR', 'COMPT CH,DISTR', 'OBS', 'ENTRETIEN']
+ENTETE_CURATIF = ['NB.SI', 'CATEGORIE', 'DESIGNATION', 'MATRICULE', 'DATE ENTREE', 'PANNE DECLAREE', 'SIT.ACTUELLE',
+                  'PIECES', 'DATE SORTIE', 'INTERVENANT', 'AFFECTATION', 'NBR INDISPONIBILITE', 'JOUR OUVRABLE', 'RATIO',
+                  'JOUR DISPONIBILITE', 'RATIO2', ' TYPE DE PANNE ', '']
+
+HUILES = ['15W40', '10W40', '20W50', 'HYD 68', '80W90']
+TYPES_PANNE = ['mécanique'] * 8 + ['électrique'] * 2 + ['autres']
+SITUATIONS = ['Réparée', 'En attente pièces', 'En cours']
+
+
+def read_sample(path: str) -> list:
+    with open(path, 'r', encoding='cp1252', errors='replace', newline='') as f:
+        return list(csv.DictReader(f, delimiter=';'))
+
+
+def write_csv(path: str, entete: list, lignes):
+    with open(path, 'w', encoding='cp1252', errors='replace', newline='') as f:
+        writer = csv.writer(f, delimiter=';', lineterminator='\r\n')
+        writer.writerow(entete)
+        writer.writerows(lignes)
+
+
+def format_date(d) -> str:
+    return d.strftime('%d/%m/%Y')
+
+
+class FleetGenerator:
+    # Vocabulaire (désignations, marques, catégories, pannes, pièces) tiré des fichiers réels de DATA_DIR
+    def __init__(self, seed: int = 42, data_dir: str = DATA_DIR):
+        self.rng = random.Random(seed)
+        self.data_dir = data_dir
+        modeles = read_sample(os.path.join(data_dir, "MATRICE.csv"))
+        self.modeles = [
+            (m['DESIGNATION'].strip(), m['MARQUE'].strip(), m['PNEUMATIQUE'].strip(), m['CATEGORIE'].strip())
+            for m in modeles if m.get('DESIGNATION', '').strip() and m.get('CATEGORIE', '').strip()
+        ]
+        pannes = read_sample(os.path.join(data_dir, "SUIVI_CURATIF.csv"))
+        self.pannes = [
+            (p['PANNE DECLAREE'].strip(), p['PIECES'].strip())
+            for p in pannes if p.get('PANNE DECLAREE', '').strip()
+        ]
+        self.intervenants = sorted({p['INTERVENANT'].strip() for p in pannes if p.get('INTERVENANT', '').strip()}) or ['Atelier']
+
+    def machines(self, nombre: int) -> list:
+        rng = self.rng
+        parc = []
+        for n in range(nombre):
+            designation, marque, pneumatique, categorie = rng.choice(self.modeles)
+            matricule = f"{n:06d}-{rng.randint(100, 999)}-{rng.choice((16, 40))}"
+            parc.append({
+                'matricule': matricule,
+                'designation': designation,
+                'annee': rng.randint(1985, 2024),
+                'qte_vidange': rng.choice((0, 5, 8, 12, 20, 30)),
+                'code_barre': f"CB{n:05d}",
+                'marque': marque,
+                'pneumatique': pneumatique,
+                'categorie': categorie,
+            })
+        return parc
+
+    def lignes_matrice(self, parc: list):
+        for m in parc:
+            yield [m['matricule'], m['designation'], m['annee'], m['qte_vidange'], m['code_barre'],
+                   m['marque'], m['pneumatique'], m['categorie']]
+
+    def lignes_vidange(self, parc: list, par_machine: int, debut, fin):
+        # NB.SI = fiche de la machine / numéro de passage, comme dans l'export d'origine
+        rng = self.rng
+        etendue = (fin - debut).days
+        for m in parc:
+            dates = sorted(debut + timedelta(days=rng.randrange(etendue)) for _ in range(par_machine))
+            compteur = rng.randint(1000, 200000)
+            for k, d in enumerate(dates, 1):
+                compteur += rng.randint(500, 8000)
+                flags = ['*' if rng.random() < p else '' for p in (0.6, 0.2, 0.1, 0.02)]
+                graissage = rng.random() < 0.15
+                entretien = 'GR' if graissage and rng.random() < 0.5 else 'VIDANGE,M'
+                yield [f"{m['matricule']}/{k}", m['qte_vidange'], 'K25', m['designation'], m['matricule'],
+                       format_date(d), '', compteur, rng.choice(HUILES), m['qte_vidange'], *flags,
+                       1 if graissage else '', '', f"COMPTEUR {compteur}", entretien]
+
+    def lignes_curatif(self, parc: list, par_machine: int, debut, fin):
+        rng = self.rng
+        etendue = (fin - debut).days
+        for m in parc:
+            nombre = rng.randint(0, 2 * par_machine)
+            for k in range(1, nombre + 1):
+                entree = debut + timedelta(days=rng.randrange(etendue))
+                duree = max(1, int(rng.expovariate(1 / 6)))
+                sortie = entree + timedelta(days=duree - 1)
+                panne, pieces = rng.choice(self.pannes)
+                ouvrables = 22
+                ratio = round(duree / ouvrables, 2)
+                disponibles = max(0, ouvrables - duree)
+                # Une partie des lignes reste sans dates, comme dans le suivi réel
+                datee = rng.random() < 0.4
+                yield [f"{m['matricule']}/{k}", m['categorie'], m['designation'], m['matricule'],
+                       format_date(entree) if datee else '', panne, rng.choice(SITUATIONS), pieces,
+                       format_date(sortie) if datee else '', rng.choice(self.intervenants), 'PARC', duree, ouvrables,
+                       str(ratio).replace('.', ','), disponibles, f"{round(100 * disponibles / ouvrables, 2)}%".replace('.', ','),
+                       rng.choice(TYPES_PANNE), '']
+
+    def generate(self, dest_dir: str, machines: int, vidanges: int, pannes: int, annee_debut: int, annee_fin: int) -> dict:
+        os.makedirs(dest_dir, exist_ok=True)
+        debut = datetime(annee_debut, 1, 1).date()
+        fin = datetime(annee_fin + 1, 1, 1).date()
+        parc = self.machines(machines)
+        write_csv(os.path.join(dest_dir, "MATRICE.csv"), ENTETE_MATRICE, self.lignes_matrice(parc))
+        write_csv(os.path.join(dest_dir, "VIDANGE.csv"), ENTETE_VIDANGE, self.lignes_vidange(parc, vidanges, debut, fin))
+        write_csv(os.path.join(dest_dir, "SUIVI_CURATIF.csv"), ENTETE_CURATIF, self.lignes_curatif(parc, pannes, debut, fin))
+        shutil.copyfile(os.path.join(self.data_dir, "Param.csv"), os.path.join(dest_dir, "Param.csv"))
+        return {
+            nom: os.path.getsize(os.path.join(dest_dir, nom))
+            for nom in ("MATRICE.csv", "VIDANGE.csv", "SUIVI_CURATIF.csv")
+        }
+
+# =============================================================================
+# 2. BENCHMARKS
+# =============================================================================
+def percentile(valeurs: list, p: float) -> float:
+    valeurs = sorted(valeurs)
+    rang = min(len(valeurs) - 1, max(0, round(p / 100 * (len(valeurs) - 1))))
+    return valeurs[rang]
+
+
+def latences(client, url: str, requetes: int, vider_cache) -> dict:
+    mesures = []
+    for _ in range(requetes):
+        if vider_cache:
+            vider_cache()
+        t0 = time.perf_counter()
+        resp = client.get(url)
+        mesures.append((time.perf_counter() - t0) * 1000)
+        if resp.status_code != 200:
+            raise RuntimeError(f"{url} : HTTP {resp.status_code}")
+    return {
+        'requetes': requetes,
+        'p50_ms': round(percentile(mesures, 50), 3),
+        'p99_ms': round(percentile(mesures, 99), 3),
+        'moyenne_ms': round(statistics.fmean(mesures), 3),
+    }
+
+
+def db_size(db_path: str) -> int:
+    return sum(os.path.getsize(p) for p in (db_path, f"{db_path}-wal") if os.path.exists(p))
+
+
+def bench_import(db_path: str, data_dir: str) -> dict:
+    db = Database(db_path)
+    db.connect()
+    db.initialize_schema()
+    t0 = time.perf_counter()
+    resultats = run_import(db, data_dir, incremental=False)
+    duree = time.perf_counter() - t0
+    db.close()
+    lignes = resultats['matrice'] + resultats['vidange'] + resultats['curatif']
+    return {
+        'lignes': lignes,
+        'duree_s': round(duree, 4),
+        'lignes_par_seconde': round(lignes / duree, 1) if duree > 0 else 0.0,
+        'fichiers': resultats['stats'],
+    }
+
+
+def bench_planning(db_path: str, data_dir: str, annee_debut: int, annee_fin: int) -> dict:
+    db = Database(db_path)
+    db.connect()
+    generator = PlanningGenerator(db, param_path=os.path.join(data_dir, "Param.csv"))
+    annees = {}
+    for annee in range(annee_debut, annee_fin + 1):
+        generator.generate_planning_for_year(annee)
+        annees[str(annee)] = generator.last_stats
+    # Recalcul incrémental des lignes à venir, un matricule touché sur cent : l'année mesurée doit
+    # contenir des dates futures, l'année courante est planifiée au besoin si la plage est passée
+    annee_incremental = max(annee_fin, datetime.now().year)
+    if annee_incremental > annee_fin:
+        generator.generate_planning_for_year(annee_incremental)
+    matricules = [row[0] for row in db.conn.execute("SELECT matricule FROM Matricules ORDER BY matricule")]
+    db.clear_matricules_modifies_years(annee_debut, annee_incremental)
+    db.mark_matricules_modifies(matricules[::100])
+    db.conn.commit()
+    generator.generate_planning_for_year(annee_incremental, incremental=True)
+    incremental = generator.last_stats
+    if not incremental['lignes']:
+        raise RuntimeError(f"recalcul incrémental {annee_incremental} : aucune ligne replanifiée")
+    db.close()
+    return {'annees': annees, 'incremental': incremental}
+
+
+def bench_api(db_path: str, requetes: int, annee: int) -> dict:
+    import api
+    api.DB_PATH = db_path
+    client = api.app.test_client()
+    urls = {
+        'planning': f"/api/planning?from={annee}-01-01&to={annee + 1}-01-01&limit=200",
+        'matricules': "/api/matricules",
+        'sync-status': "/api/sync-status",
+    }
+    resultats = {}
+    for nom, url in urls.items():
+        resultats[nom] = {
+            'sans_cache': latences(client, url, requetes, api.response_cache.clear),
+            'avec_cache': latences(client, url, requetes, None),
+        }
+    return resultats
+
+
+def run_benchmarks(machines: int, vidanges: int, pannes: int, annee_debut: int, annee_fin: int,
+                   requetes: int, seed: int, work_dir: str = None) -> dict:
+    work_dir = work_dir or tempfile.mkdtemp(prefix="bench-maintenance-")
+    data_dir = os.path.join(work_dir, "data")
+    db_path = os.path.join(work_dir, "bench.db")
+    for p in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        if os.path.exists(p):
+            os.remove(p)
+
+    t0 = time.perf_counter()
+    tailles = FleetGenerator(seed).generate(data_dir, machines, vidanges, pannes, annee_debut - 3, annee_debut)
+    generation = {'duree_s': round(time.perf_counter() - t0, 4), 'octets': tailles}
+
+    resultats = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'sqlite': sqlite3.sqlite_version,
+        'parametres': {
+            'machines': machines, 'vidanges_par_machine': vidanges, 'pannes_par_machine': pannes,
+            'annee_debut': annee_debut, 'annee_fin': annee_fin, 'requetes': requetes, 'seed': seed,
+        },
+        'generation': generation,
+        'import': bench_import(db_path, data_dir),
+    }
+    resultats['planning'] = bench_planning(db_path, data_dir, annee_debut, annee_fin)
+    resultats['taille_db_octets'] = db_size(db_path)
+    resultats['api'] = bench_api(db_path, requetes, annee_debut)
+    resultats['repertoire'] = work_dir
+    return resultats
+
+# =============================================================================
+# 3. MAIN
+# =============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Parc synthétique et mesures de performance (import, planning, API)")
+    parser.add_argument('--machines', type=int, default=10000)
+    parser.add_argument('--vidanges', type=int, default=40, help="passages VIDANGE par machine")
+    parser.add_argument('--pannes', type=int, default=10, help="pannes curatives moyennes par machine")
+    parser.add_argument('--annee', type=int, default=datetime.now().year)
+    parser.add_argument('--annee-fin', type=int, default=None)
+    parser.add_argument('--requetes', type=int, default=200, help="requêtes par endpoint")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dir', default=None, help="répertoire de travail (temporaire par défaut)")
+    parser.add_argument('--generer-seulement', action='store_true', help="écrit les CSV dans --dir sans mesurer")
+    parser.add_argument('--output', default=None, help="fichier JSON de résultats (stdout par défaut)")
+    args = parser.parse_args()
+
+    # Traces des imports et de la planification sur stderr : stdout ne porte que le JSON
+    with redirect_stdout(sys.stderr):
+        resultats = run(args)
+    sortie = json.dumps(resultats, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(sortie)
+    else:
+        print(sortie)
+
+
+def run(args) -> dict:
+    if args.generer_seulement:
+        dest = args.dir or tempfile.mkdtemp(prefix="parc-synthetique-")
+        tailles = FleetGenerator(args.seed).generate(dest, args.machines, args.vidanges, args.pannes, args.annee - 3, args.annee)
+        resultats = {'repertoire': dest, 'octets': tailles}
+    else:
+        resultats = run_benchmarks(args.machines, args.vidanges, args.pannes, args.annee, args.annee_fin or args.annee,
+                                   args.requetes, args.seed, args.dir)
+    return resultats
+
+
+if __name__ == "__main__":
+    main()
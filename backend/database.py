@@ -0,0 +1,236 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+from metrics import registry
+
+# =============================================================================
+# Accès base partagé par l'API et les traitements (imports, planification)
+# =============================================================================
+POOL_SIZE = 8
+POOL_ACQUIRE_TIMEOUT_S = 10.0
+# SQLite attend lui-même LOCK_POLL_S sur un verrou, puis la boucle de reprise prend le relais
+# jusqu'à LOCK_TIMEOUT_S : le temps passé à attendre est ainsi mesurable
+LOCK_POLL_S = 0.05
+LOCK_TIMEOUT_S = 30.0
+# Écrivains hors pool (CLI, jobs, bench) : pas de boucle de reprise, SQLite attend lui-même le verrou
+WRITE_BUSY_TIMEOUT_S = 10.0
+# Cache des requêtes préparées de sqlite3 (clé = texte SQL) : garder des SQL constants et paramétrés
+STATEMENT_CACHE_SIZE = 256
+# Requêtes plus lentes que SLOW_QUERY_MS journalisées sur stderr ; SQL_TRACE=1 active en plus le hook de trace
+# SQLite (appelé pour chaque instruction exécutée, y compris chaque ligne d'un executemany : coûteux en import)
+SLOW_QUERY_S = float(os.environ.get('SLOW_QUERY_MS', '250')) / 1000
+SQL_TRACE = os.environ.get('SQL_TRACE', '') not in ('', '0')
+
+
+def sql_verb(sql: str) -> str:
+    mots = sql.split(None, 1)
+    return mots[0].upper() if mots else ''
+
+
+class TracedCursor(sqlite3.Cursor):
+    # Durée de chaque execute/executemany (pour un SELECT : jusqu'à la première ligne disponible)
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            record_statement(sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, params):
+        # Lot complet (imports, planning) : mesuré à part et jamais signalé comme requête lente
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            registry.observe('sqlite_batch_seconds', time.perf_counter() - t0, verbe=sql_verb(sql))
+
+
+class TracedConnection(sqlite3.Connection):
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+
+def record_statement(sql: str, duree: float):
+    verbe = sql_verb(sql)
+    registry.observe('sqlite_statement_seconds', duree, verbe=verbe)
+    if duree >= SLOW_QUERY_S:
+        registry.inc('sqlite_slow_queries_total', verbe=verbe)
+        print(f"Requête lente ({duree * 1000:.0f} ms) : {' '.join(sql.split())[:300]}", file=sys.stderr)
+
+
+def trace_statement(sql: str):
+    registry.inc('sqlite_statements_traced_total', verbe=sql_verb(sql))
+
+
+def open_connection(db_path: str, readonly: bool = False, check_same_thread: bool = True,
+                    timeout: float = WRITE_BUSY_TIMEOUT_S) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout, factory=TracedConnection,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        conn = sqlite3.connect(db_path, timeout=timeout, factory=TracedConnection,
+                               cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=check_same_thread)
+        # WAL : les lecteurs de l'API ne sont plus bloqués par un import ou une planification en cours
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    if SQL_TRACE:
+        conn.set_trace_callback(trace_statement)
+    return conn
+
+
+def is_lock_error(e: sqlite3.OperationalError) -> bool:
+    message = str(e).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, readonly: bool = True, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.size = size
+        self.idle = Queue(maxsize=size)
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.stats = {
+            'acquisitions': 0,
+            'connexions_ouvertes': 0,
+            'reutilisations': 0,
+            'attentes_pool': 0,
+            'attente_pool_s': 0.0,
+            'attentes_verrou': 0,
+            'attente_verrou_s': 0.0,
+            'echecs_verrou': 0,
+        }
+
+    def _count(self, cle: str, valeur=1):
+        with self.lock:
+            self.stats[cle] += valeur
+
+    def acquire(self) -> sqlite3.Connection:
+        self._count('acquisitions')
+        try:
+            conn = self.idle.get_nowait()
+            self._count('reutilisations')
+            return conn
+        except Empty:
+            pass
+        with self.lock:
+            peut_ouvrir = self.opened < self.size
+            if peut_ouvrir:
+                self.opened += 1
+        if peut_ouvrir:
+            try:
+                # Attente courte côté SQLite, la boucle de execute_on mesure et prolonge l'attente
+                conn = open_connection(self.db_path, readonly=self.readonly, check_same_thread=False, timeout=LOCK_POLL_S)
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+            self._count('connexions_ouvertes')
+            return conn
+        # Pool plein : attente qu'une connexion soit rendue par un autre thread
+        t0 = time.perf_counter()
+        conn = self.idle.get(timeout=POOL_ACQUIRE_TIMEOUT_S)
+        self._count('attentes_pool')
+        self._count('attente_pool_s', time.perf_counter() - t0)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except Full:
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def execute_on(self, conn: sqlite3.Connection, sql: str, params=()):
+        debut_attente = None
+        while True:
+            try:
+                cursor = conn.execute(sql, params)
+                break
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                maintenant = time.perf_counter()
+                if debut_attente is None:
+                    debut_attente = maintenant - LOCK_POLL_S
+                    self._count('attentes_verrou')
+                if maintenant - debut_attente > LOCK_TIMEOUT_S:
+                    self._count('echecs_verrou')
+                    self._count('attente_verrou_s', maintenant - debut_attente)
+                    raise
+                time.sleep(LOCK_POLL_S)
+        if debut_attente is not None:
+            self._count('attente_verrou_s', time.perf_counter() - debut_attente)
+        return cursor
+
+    def fetchall(self, sql: str, params=()) -> list:
+        with self.connection() as conn:
+            return self.execute_on(conn, sql, params).fetchall()
+
+    def fetchone(self, sql: str, params=()):
+        with self.connection() as conn:
+            return self.execute_on(conn, sql, params).fetchone()
+
+    def metrics(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['connexions_actives'] = self.opened - self.idle.qsize()
+            stats['connexions_pool'] = self.opened
+        stats['taille_pool'] = self.size
+        stats['lecture_seule'] = self.readonly
+        stats['attente_pool_s'] = round(stats['attente_pool_s'], 6)
+        stats['attente_verrou_s'] = round(stats['attente_verrou_s'], 6)
+        return stats
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, readonly: bool = True) -> ConnectionPool:
+    with _pools_lock:
+        cle = (db_path, readonly)
+        if cle not in _pools:
+            _pools[cle] = ConnectionPool(db_path, readonly=readonly)
+        return _pools[cle]
+
+
+def pool_metrics() -> dict:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {f"{p.db_path}{' (lecture)' if p.readonly else ''}": p.metrics() for p in pools}
@@ -0,0 +1,166 @@
+import itertools
+import json
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from maintenance import Database, run_import, run_planning
+
+# =============================================================================
+# Jobs d'arrière-plan (imports, planification) déclenchés depuis l'API
+# =============================================================================
+JOB_WORKERS = 2
+JOB_HISTORY = 100
+SSE_KEEPALIVE_S = 15.0
+
+STATUTS_ACTIFS = ('en_attente', 'en_cours')
+
+
+class Job:
+    def __init__(self, job_id: str, type_job: str, cle: tuple, params: dict):
+        self.id = job_id
+        self.type = type_job
+        self.cle = cle
+        self.params = params
+        self.statut = 'en_attente'
+        self.etape = None
+        self.lignes = 0
+        self.resultat = None
+        self.erreur = None
+        self.soumissions = 1
+        self.cree_le = time.time()
+        self.debut = None
+        self.fin = None
+        self.events = []
+        self.condition = threading.Condition()
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'type': self.type,
+            'params': self.params,
+            'statut': self.statut,
+            'etape': self.etape,
+            'lignes': self.lignes,
+            'resultat': self.resultat,
+            'erreur': self.erreur,
+            'soumissions': self.soumissions,
+            'duree_s': round((self.fin or time.time()) - self.debut, 3) if self.debut else None,
+        }
+
+    def publish(self, event: str, **data):
+        with self.condition:
+            self.events.append((event, data))
+            self.condition.notify_all()
+
+    def finish(self, statut: str):
+        # Statut final et dernier événement publiés ensemble, pour qu'aucun flux ne s'arrête avant de l'avoir reçu
+        with self.condition:
+            self.fin = time.time()
+            self.statut = statut
+            self.events.append(('status', self.to_dict()))
+            self.condition.notify_all()
+
+    def progress(self, etape: str, lignes: int):
+        self.etape = etape
+        self.lignes = lignes
+        self.publish('progress', etape=etape, lignes=lignes)
+
+    @property
+    def termine(self) -> bool:
+        return self.statut not in STATUTS_ACTIFS
+
+    def stream(self, depuis: int = 0):
+        # Flux Server-Sent Events : rejoue les événements déjà émis puis suit le job jusqu'à sa fin
+        index = depuis
+        while True:
+            with self.condition:
+                if index >= len(self.events) and not self.termine:
+                    self.condition.wait(timeout=SSE_KEEPALIVE_S)
+                nouveaux = self.events[index:]
+                fini = self.termine
+            for event, data in nouveaux:
+                index += 1
+                yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+            if fini and index >= len(self.events):
+                return
+            if not nouveaux:
+                yield ": keepalive\n\n"
+
+
+class JobRunner:
+    def __init__(self, db_path: str, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.actifs = {}
+        self.lock = threading.Lock()
+        # Un seul job écrit à la fois dans la base : évite les erreurs SQLITE_BUSY entre imports et planification
+        self.write_lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        # Schéma créé et migré par le premier job seulement (sous write_lock)
+        self.schema_initialise = False
+
+    def submit(self, type_job: str, cle: tuple, params: dict, fonction):
+        # Une soumission identique à un job en attente ou en cours est fusionnée avec lui
+        with self.lock:
+            job = self.actifs.get(cle)
+            if job is not None:
+                job.soumissions += 1
+                return job, False
+            job = Job(f"{type_job}-{next(self.sequence)}", type_job, cle, params)
+            self.jobs[job.id] = job
+            self.actifs[cle] = job
+            self._purge()
+        job.publish('status', statut=job.statut)
+        self.executor.submit(self._run, job, fonction)
+        return job, True
+
+    def submit_import(self, incremental: bool = True):
+        params = {'incremental': incremental}
+        return self.submit('import', ('import', incremental), params,
+                           lambda db, job: run_import(db, incremental=incremental, progress=job.progress))
+
+    def submit_planning(self, annee: int, incremental: bool = False, annee_fin: int = None):
+        params = {'annee': annee, 'incremental': incremental, 'annee_fin': annee_fin}
+        return self.submit('planning', ('planning', annee, incremental, annee_fin), params,
+                           lambda db, job: run_planning(db, annee, incremental=incremental, progress=job.progress,
+                                                        annee_fin=annee_fin))
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> list:
+        with self.lock:
+            return [job.to_dict() for job in reversed(list(self.jobs.values()))]
+
+    def _purge(self):
+        termines = [j for j in self.jobs.values() if j.termine]
+        for job in termines[:max(0, len(self.jobs) - JOB_HISTORY)]:
+            del self.jobs[job.id]
+
+    def _run(self, job: Job, fonction):
+        with self.write_lock:
+            job.debut = time.time()
+            job.statut = 'en_cours'
+            job.publish('status', statut=job.statut)
+            db = Database(self.db_path)
+            statut = 'erreur'
+            try:
+                db.connect()
+                if not self.schema_initialise:
+                    db.initialize_schema()
+                    self.schema_initialise = True
+                job.resultat = fonction(db, job)
+                statut = 'termine'
+            except Exception as e:
+                traceback.print_exc()
+                job.erreur = str(e)
+            finally:
+                db.close()
+                with self.lock:
+                    if self.actifs.get(job.cle) is job:
+                        del self.actifs[job.cle]
+                job.finish(statut)
@@ -4,6 +4,42 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 import unicodedata
 import os
+import io
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+
+from database import open_connection
+from metrics import registry
+
+IMPORT_BATCH_SIZE = 5000
+PLANNING_TYPES = {'C': 'Controle', 'N': 'Nettoyage', 'CH': 'Changement'}
+# Recherche plein texte : tables FTS5 à contenu externe, synchronisées par les imports.
+# remove_diacritics 2 replie les accents comme normalize_header (décomposition NFD sans les diacritiques)
+RECHERCHE_TOKENIZER = "unicode61 remove_diacritics 2"
+RECHERCHE_INDEX = {
+    'Recherche_Matricules': ('Matricules', 'rowid', ('matricule', 'designation', 'marque', 'code_barre', 'categorie')),
+    'Recherche_Curatif': ('Historique_Curatif', 'id', ('matricule', 'designation', 'panne_declaree', 'pieces')),
+}
+
+PLANNING_INSERT = """
+    INSERT INTO Planning (type_intervention, matricule, nom_entretien, date_prevue, date_reference,
+                          source_reference, statut, observations)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+PLANNING_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_planning_date ON Planning(date_prevue, type_intervention, matricule)",
+    "CREATE INDEX IF NOT EXISTS idx_planning_matricule ON Planning(matricule, date_prevue)",
+    # Filtre par statut (ex. annulations curatives) parcouru dans l'ordre de pagination par clé
+    "CREATE INDEX IF NOT EXISTS idx_planning_statut ON Planning(statut, date_prevue, type_intervention, matricule)",
+]
+CHECKPOINT_BLOC = 65536
+# Colonnes d'une ligne curative corrigeables par une resynchronisation (nb_si est la clé)
+CURATIF_COLONNES = ('matricule', 'categorie', 'designation', 'date_entree', 'panne_declaree', 'situation_actuelle',
+                    'pieces', 'date_sortie', 'intervenant', 'affectation', 'nb_indisponibilite', 'jour_ouvrable', 'type_panne')
 
 # =============================================================================
 # 1. DATABASE
@@ -14,16 +50,35 @@ class Database:
         self.conn = None
 
     def connect(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
+        self.conn = open_connection(self.db_path)
         return self.conn
 
     def close(self):
         if self.conn:
             self.conn.close()
 
+    @contextmanager
+    def bulk_import(self):
+        # Réglages adaptés aux imports massifs, restaurés en sortie
+        self.conn.commit()
+        synchronous = self.conn.execute("PRAGMA synchronous").fetchone()[0]
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-65536")
+        try:
+            yield self.conn
+        finally:
+            self.conn.commit()
+            self.conn.execute(f"PRAGMA synchronous={int(synchronous)}")
+
+    def bump_generation(self):
+        # Numéro de génération des données : invalide les réponses mises en cache par l'API
+        self.conn.execute("UPDATE Data_Generation SET generation = generation + 1 WHERE id = 1")
+
     def initialize_schema(self):
         cursor = self.conn.cursor()
+        modifications = self.conn.total_changes
         # Tables
         cursor.execute(""" CREATE TABLE IF NOT EXISTS Matricules (
             matricule TEXT PRIMARY KEY, designation TEXT NOT NULL, annee INTEGER,
@@ -54,31 +109,64 @@ class Database:
             nb_indisponibilite INTEGER, jour_ouvrable INTEGER, type_panne TEXT, nb_si TEXT,
             FOREIGN KEY (matricule) REFERENCES Matricules(matricule)
         ) """)
-        cursor.execute(""" CREATE TABLE IF NOT EXISTS Planning_Controle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, matricule TEXT NOT NULL,
-            nom_entretien TEXT NOT NULL, date_prevue DATE NOT NULL, date_realisee DATE,
-            statut TEXT DEFAULT 'a_faire', date_reference DATE, source_reference TEXT, observations TEXT,
-            CHECK (statut IN ('a_faire', 'realise', 'reporte')),
-            FOREIGN KEY (matricule) REFERENCES Matricules(matricule)
-        ) """)
-        cursor.execute(""" CREATE TABLE IF NOT EXISTS Planning_Nettoyage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, matricule TEXT NOT NULL,
-            nom_entretien TEXT NOT NULL, date_prevue DATE NOT NULL, date_realisee DATE,
-            statut TEXT DEFAULT 'a_faire', date_reference DATE, source_reference TEXT, observations TEXT,
-            CHECK (statut IN ('a_faire', 'realise', 'annule_curatif', 'reporte')),
-            FOREIGN KEY (matricule) REFERENCES Matricules(matricule)
-        ) """)
-        cursor.execute(""" CREATE TABLE IF NOT EXISTS Planning_Changement (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, matricule TEXT NOT NULL,
+        # Planning unifié : une ligne par intervention prévue, type codé C/N/CH
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS Planning (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, type_intervention TEXT NOT NULL, matricule TEXT NOT NULL,
             nom_entretien TEXT NOT NULL, date_prevue DATE NOT NULL, date_realisee DATE,
             statut TEXT DEFAULT 'a_faire', date_reference DATE, source_reference TEXT, observations TEXT,
+            CHECK (type_intervention IN ('C', 'N', 'CH')),
             CHECK (statut IN ('a_faire', 'realise', 'annule_curatif', 'reporte')),
+            CHECK (type_intervention != 'C' OR statut != 'annule_curatif'),
             FOREIGN KEY (matricule) REFERENCES Matricules(matricule)
         ) """)
+        self.migrate_planning_tables()
         cursor.execute(""" CREATE TABLE IF NOT EXISTS Sync_Log (
             id INTEGER PRIMARY KEY AUTOINCREMENT, type_sync TEXT NOT NULL,
             dernier_nbsi TEXT, date_sync DATETIME DEFAULT CURRENT_TIMESTAMP,
-            nb_lignes_ajoutees INTEGER, statut TEXT, message TEXT
+            nb_lignes_ajoutees INTEGER, statut TEXT, message TEXT, durees TEXT
+        ) """)
+        # Durées des étapes (JSON) : colonne ajoutée aux bases existantes
+        if 'durees' not in {row[1] for row in cursor.execute("PRAGMA table_info(Sync_Log)")}:
+            cursor.execute("ALTER TABLE Sync_Log ADD COLUMN durees TEXT")
+        # Dernière réalisation connue par (matricule, entretien, type), maintenue par les imports
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS Derniere_Intervention (
+            matricule TEXT NOT NULL, nom_entretien TEXT NOT NULL, type_intervention TEXT NOT NULL,
+            date_realisation DATE NOT NULL, source_fichier TEXT,
+            PRIMARY KEY (matricule, nom_entretien, type_intervention)
+        ) """)
+        # Point de reprise par fichier source : offset, nombre de lignes et empreinte du préfixe consommé
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS Sync_Checkpoint (
+            type_sync TEXT PRIMARY KEY, fichier TEXT, offset INTEGER NOT NULL DEFAULT 0,
+            nb_lignes INTEGER NOT NULL DEFAULT 0, empreinte TEXT, date_sync DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) """)
+        # Génération des données, incrémentée par chaque import ou planification
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS Data_Generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL DEFAULT 0
+        ) """)
+        cursor.execute("INSERT OR IGNORE INTO Data_Generation (id, generation) VALUES (1, 0)")
+        # Matricules touchés par un import, par année de planning restant à recalculer en incrémental
+        colonnes = {row[1] for row in cursor.execute("PRAGMA table_info(Matricules_Modifies)")}
+        ancien = colonnes and 'annee' not in colonnes
+        if ancien:
+            cursor.execute("ALTER TABLE Matricules_Modifies RENAME TO Matricules_Modifies_Ancien")
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS Matricules_Modifies (
+            matricule TEXT NOT NULL, annee INTEGER NOT NULL, date_modif DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (matricule, annee)
+        ) """)
+        if ancien:
+            self.mark_matricules_modifies([row[0] for row in cursor.execute("SELECT matricule FROM Matricules_Modifies_Ancien")])
+            cursor.execute("DROP TABLE Matricules_Modifies_Ancien")
+        # Agrégats curatifs (indisponibilité, fiabilité), tenus à jour par import_suivi_curatif
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS KPI_Indisponibilite (
+            matricule TEXT NOT NULL, categorie TEXT NOT NULL, mois TEXT NOT NULL, type_panne TEXT NOT NULL,
+            nb_pannes INTEGER NOT NULL DEFAULT 0, jours_indisponibilite INTEGER NOT NULL DEFAULT 0,
+            jours_ouvrables INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (matricule, categorie, mois, type_panne)
+        ) """)
+        cursor.execute(""" CREATE TABLE IF NOT EXISTS KPI_Fiabilite (
+            matricule TEXT PRIMARY KEY, categorie TEXT, nb_pannes INTEGER NOT NULL DEFAULT 0,
+            nb_pannes_datees INTEGER NOT NULL DEFAULT 0, jours_indisponibilite INTEGER NOT NULL DEFAULT 0,
+            premiere_panne DATE, derniere_panne DATE
         ) """)
         # Index
         for idx in [
@@ -87,20 +175,233 @@ class Database:
             "CREATE INDEX IF NOT EXISTS idx_hist_cur_matricule ON Historique_Curatif(matricule)",
             "CREATE INDEX IF NOT EXISTS idx_hist_cur_date ON Historique_Curatif(date_sortie)",
             "CREATE INDEX IF NOT EXISTS idx_exclusions ON Exclusions(categorie)",
-            "CREATE INDEX IF NOT EXISTS idx_planning_c_matricule ON Planning_Controle(matricule)",
-            "CREATE INDEX IF NOT EXISTS idx_planning_n_matricule ON Planning_Nettoyage(matricule)",
-            "CREATE INDEX IF NOT EXISTS idx_planning_ch_matricule ON Planning_Changement(matricule)"
+            "CREATE INDEX IF NOT EXISTS idx_kpi_categorie ON KPI_Indisponibilite(categorie, mois)",
+            *PLANNING_INDEXES
         ]:
             cursor.execute(idx)
+        # Index uniques de resynchronisation ; dans VIDANGE, nb_si est propre à la machine et non à la ligne,
+        # une ligne source est identifiée par tout son contenu (nb_si, entretien, date, compteur, observations)
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_hist_prev_nbsi'").fetchone():
+            # Ancienne clé sans compteur : des lignes distinctes ont pu être écartées, VIDANGE est relu en entier
+            cursor.execute("DROP INDEX idx_hist_prev_nbsi")
+            cursor.execute("DELETE FROM Sync_Checkpoint WHERE type_sync = 'VIDANGE'")
+        self.create_unique_index('Historique_Preventif', 'idx_hist_prev_ligne', "nb_si, nom_entretien, date_realisation, IFNULL(compteur_km_h, -1), IFNULL(observations, '')")
+        self.create_unique_index('Historique_Curatif', 'idx_hist_cur_nbsi', "nb_si")
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM Derniere_Intervention)")
+        if not cursor.fetchone()[0]:
+            self.rebuild_derniere_intervention()
+        self.create_search_indexes()
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM KPI_Fiabilite)")
+        if not cursor.fetchone()[0]:
+            self.rebuild_kpis()
+        # Migrations ou reconstructions effectuées : les réponses en cache ne sont plus à jour
+        if self.conn.total_changes != modifications:
+            self.bump_generation()
         self.conn.commit()
         print("Schéma de base de données initialisé")
 
+    def create_unique_index(self, table: str, nom: str, cle: str):
+        # Les doublons antérieurs à l'index (synchros lexicographiques) sont archivés dans <table>_Doublons, pas effacés
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (nom,)).fetchone():
+            return
+        cursor = self.conn.cursor()
+        doublons = f"""SELECT * FROM {table} WHERE nb_si IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM {table} WHERE nb_si IS NOT NULL GROUP BY {cle})"""
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_Doublons AS SELECT * FROM {table} WHERE 0")
+        cursor.execute(f"INSERT INTO {table}_Doublons {doublons}")
+        archives = cursor.rowcount
+        if archives:
+            cursor.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table}_Doublons)")
+            print(f"{table}: {archives} doublons déplacés dans {table}_Doublons avant création de {nom}")
+        cursor.execute(f"CREATE UNIQUE INDEX {nom} ON {table}({cle})")
+
+    def migrate_planning_tables(self):
+        # Les anciennes tables Planning_Controle/Nettoyage/Changement sont versées dans Planning
+        # puis remplacées par des vues du même nom, en lecture seule
+        cursor = self.conn.cursor()
+        for type_interv, libelle in PLANNING_TYPES.items():
+            nom = f"Planning_{libelle}"
+            cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (nom,))
+            row = cursor.fetchone()
+            if row and row[0] == 'table':
+                cursor.execute(f"""
+                    INSERT INTO Planning (type_intervention, matricule, nom_entretien, date_prevue, date_realisee,
+                                          statut, date_reference, source_reference, observations)
+                    SELECT ?, matricule, nom_entretien, date_prevue, date_realisee,
+                           statut, date_reference, source_reference, observations
+                    FROM {nom}
+                """, (type_interv,))
+                migrees = cursor.rowcount
+                cursor.execute(f"DROP TABLE {nom}")
+                print(f"{migrees} lignes de {nom} migrées vers Planning")
+            cursor.execute(f"""
+                CREATE VIEW IF NOT EXISTS {nom} AS
+                SELECT id, matricule, nom_entretien, date_prevue, date_realisee, statut,
+                       date_reference, source_reference, observations
+                FROM Planning WHERE type_intervention = '{type_interv}'
+            """)
+
+    def rebuild_derniere_intervention(self):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM Derniere_Intervention")
+        cursor.execute("""
+            INSERT INTO Derniere_Intervention (matricule, nom_entretien, type_intervention, date_realisation, source_fichier)
+            SELECT matricule, nom_entretien, type_intervention, MAX(date_realisation), source_fichier
+            FROM Historique_Preventif
+            WHERE type_intervention IS NOT NULL
+            GROUP BY matricule, nom_entretien, type_intervention
+        """)
+        return cursor.rowcount
+
+    def update_derniere_intervention(self, realisations: dict):
+        # realisations : {(matricule, nom_entretien, type): (date_realisation, source_fichier)}
+        self.conn.executemany("""
+            INSERT INTO Derniere_Intervention (matricule, nom_entretien, type_intervention, date_realisation, source_fichier)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (matricule, nom_entretien, type_intervention) DO UPDATE SET
+                date_realisation = excluded.date_realisation, source_fichier = excluded.source_fichier
+            WHERE excluded.date_realisation > Derniere_Intervention.date_realisation
+        """, [(*cle, str(d), source) for cle, (d, source) in realisations.items()])
+
+    def create_search_indexes(self):
+        # Index créé (ou recréé) : alimenté d'un coup depuis sa table source
+        for nom, (table, rowid, colonnes) in RECHERCHE_INDEX.items():
+            existe = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (nom,)).fetchone()
+            if existe:
+                continue
+            self.conn.execute(f"""
+                CREATE VIRTUAL TABLE {nom} USING fts5(
+                    {', '.join(colonnes)}, content='{table}', content_rowid='{rowid}', tokenize='{RECHERCHE_TOKENIZER}'
+                )
+            """)
+            self.rebuild_search_index(nom)
+
+    def rebuild_search_index(self, nom: str):
+        self.conn.execute(f"INSERT INTO {nom} ({nom}) VALUES ('rebuild')")
+
+    def index_curatif(self, depuis_id: int):
+        # Lignes insérées par l'import courant uniquement (les corrections passent par une reconstruction)
+        table, rowid, colonnes = RECHERCHE_INDEX['Recherche_Curatif']
+        self.conn.execute(f"""
+            INSERT INTO Recherche_Curatif (rowid, {', '.join(colonnes)})
+            SELECT {rowid}, {', '.join(colonnes)} FROM {table} WHERE {rowid} > ?
+        """, (depuis_id,))
+
+    def log_sync(self, type_sync: str, dernier_nbsi, count: int, message: str, durees: dict) -> int:
+        return self.conn.execute(
+            "INSERT INTO Sync_Log (type_sync, dernier_nbsi, nb_lignes_ajoutees, statut, message, durees) VALUES (?, ?, ?, 'SUCCESS', ?, ?)",
+            (type_sync, dernier_nbsi, count, message, json.dumps(durees))
+        ).lastrowid
+
+    def update_sync_durees(self, sync_id: int, durees: dict):
+        self.conn.execute("UPDATE Sync_Log SET durees = ? WHERE id = ?", (json.dumps(durees), sync_id))
+
+    def rebuild_kpis(self):
+        self.conn.execute("DELETE FROM KPI_Indisponibilite")
+        self.conn.execute("DELETE FROM KPI_Fiabilite")
+        self.update_kpis(0)
+
+    def update_kpis(self, depuis_id: int):
+        # Cumule dans les agrégats les lignes curatives d'id > depuis_id (celles que l'import vient d'insérer) ;
+        # jour_ouvrable est un nombre de jours ouvrés du mois, conservé et non additionné
+        self.conn.execute("""
+            INSERT INTO KPI_Indisponibilite (matricule, categorie, mois, type_panne, nb_pannes, jours_indisponibilite, jours_ouvrables)
+            SELECT matricule, COALESCE(categorie, ''), COALESCE(substr(date_entree, 1, 7), ''), COALESCE(type_panne, ''),
+                   COUNT(*), COALESCE(SUM(nb_indisponibilite), 0), COALESCE(MAX(jour_ouvrable), 0)
+            FROM Historique_Curatif
+            WHERE id > ?
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (matricule, categorie, mois, type_panne) DO UPDATE SET
+                nb_pannes = nb_pannes + excluded.nb_pannes,
+                jours_indisponibilite = jours_indisponibilite + excluded.jours_indisponibilite,
+                jours_ouvrables = MAX(jours_ouvrables, excluded.jours_ouvrables)
+        """, (depuis_id,))
+        self.conn.execute("""
+            INSERT INTO KPI_Fiabilite (matricule, categorie, nb_pannes, nb_pannes_datees, jours_indisponibilite, premiere_panne, derniere_panne)
+            SELECT matricule, MAX(categorie), COUNT(*), COUNT(date_entree), COALESCE(SUM(nb_indisponibilite), 0),
+                   MIN(date_entree), MAX(date_entree)
+            FROM Historique_Curatif
+            WHERE id > ?
+            GROUP BY matricule
+            ON CONFLICT (matricule) DO UPDATE SET
+                categorie = COALESCE(excluded.categorie, categorie),
+                nb_pannes = nb_pannes + excluded.nb_pannes,
+                nb_pannes_datees = nb_pannes_datees + excluded.nb_pannes_datees,
+                jours_indisponibilite = jours_indisponibilite + excluded.jours_indisponibilite,
+                premiere_panne = MIN(COALESCE(premiere_panne, excluded.premiere_panne), COALESCE(excluded.premiere_panne, premiere_panne)),
+                derniere_panne = MAX(COALESCE(derniere_panne, excluded.derniere_panne), COALESCE(excluded.derniere_panne, derniere_panne))
+        """, (depuis_id,))
+
+    def planned_years(self) -> range:
+        # Années contenant du planning à venir : de l'année courante à la dernière année planifiée
+        annee = datetime.now().year
+        row = self.conn.execute("SELECT MAX(date_prevue) FROM Planning").fetchone()
+        derniere = int(str(row[0])[:4]) if row and row[0] else annee
+        return range(annee, max(annee, derniere) + 1)
+
+    def mark_matricules_modifies(self, matricules):
+        # Un marquage par année à venir : chaque année est vidée seulement quand elle a été recalculée
+        annees = self.planned_years()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO Matricules_Modifies (matricule, annee, date_modif) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            [(m, annee) for m in matricules for annee in annees]
+        )
+
+    def load_matricules_modifies(self, annee: int) -> set:
+        return {row[0] for row in self.conn.execute("SELECT matricule FROM Matricules_Modifies WHERE annee = ?", (annee,))}
+
+    def clear_matricules_modifies(self, matricules, annee: int):
+        self.conn.executemany("DELETE FROM Matricules_Modifies WHERE matricule = ? AND annee = ?", [(m, annee) for m in matricules])
+
+    def clear_matricules_modifies_years(self, annee_debut: int, annee_fin: int):
+        # Planification complète d'une plage d'années : plus rien à recalculer pour ces années
+        self.conn.execute("DELETE FROM Matricules_Modifies WHERE annee BETWEEN ? AND ?", (annee_debut, annee_fin))
+
+    def load_sync_checkpoint(self, type_sync: str) -> Optional[dict]:
+        row = self.conn.execute("SELECT offset, nb_lignes, empreinte FROM Sync_Checkpoint WHERE type_sync = ?", (type_sync,)).fetchone()
+        return {'offset': row[0], 'nb_lignes': row[1], 'empreinte': row[2]} if row else None
+
+    def save_sync_checkpoint(self, type_sync: str, fichier: str, offset: int, nb_lignes: int, empreinte: str):
+        self.conn.execute("""
+            INSERT OR REPLACE INTO Sync_Checkpoint (type_sync, fichier, offset, nb_lignes, empreinte, date_sync)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (type_sync, fichier, offset, nb_lignes, empreinte))
+
+    def load_immobilisations(self, matricules=None) -> list:
+        # Sans date de sortie, la durée d'immobilisation déclarée (nb_indisponibilite) sert d'estimation
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT matricule, date_entree, date_sortie, nb_indisponibilite FROM Historique_Curatif WHERE date_entree IS NOT NULL")
+        immobilisations = []
+        for matricule, entree, sortie, nb_jours in cursor.fetchall():
+            if matricules is not None and matricule not in matricules:
+                continue
+            entree = datetime.strptime(str(entree)[:10], '%Y-%m-%d').date()
+            if sortie:
+                sortie = datetime.strptime(str(sortie)[:10], '%Y-%m-%d').date()
+            else:
+                sortie = entree + timedelta(days=max(0, (nb_jours or 0) - 1))
+            if sortie >= entree:
+                immobilisations.append((matricule, entree, sortie))
+        return immobilisations
+
+    def load_derniere_intervention(self) -> dict:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT matricule, nom_entretien, type_intervention, date_realisation, source_fichier FROM Derniere_Intervention")
+        return {
+            (row[0], row[1], row[2]): (datetime.strptime(str(row[3])[:10], '%Y-%m-%d').date(), row[4])
+            for row in cursor.fetchall()
+        }
+
 # =============================================================================
 # 2. DATA IMPORTER
 # =============================================================================
 class DataImporter:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, progress=None):
         self.db = db
+        # progress(etape, lignes) : appelé après chaque lot inséré (suivi des jobs de l'API)
+        self.progress = progress
+        self.matricules_modifies = set()
+        self.last_stats = {}
 
     def safe_str(self, val):
         return val.strip() if val and str(val).strip() else ''
@@ -133,39 +434,204 @@ class DataImporter:
         header = ''.join(c for c in unicodedata.normalize('NFD', header) if unicodedata.category(c) != 'Mn')
         return header
 
+    def iter_csv(self, csv_path: str, offset: int = 0, lecture: dict = None):
+        # En-têtes normalisés une seule fois, lignes lues en flux (mémoire constante).
+        # cp1252 étant mono-octet, la longueur des lignes lues donne directement l'offset en octets.
+        lecture = lecture if lecture is not None else {}
+        lecture.setdefault('lignes', 0)
+        lecture.setdefault('duree_parse_s', 0.0)
+        with open(csv_path, 'rb') as raw:
+            entete = raw.readline().decode('cp1252', errors='replace')
+            header = next(csv.reader([entete], delimiter=';'), None)
+            if not header:
+                lecture['offset'] = raw.tell()
+                return
+            colonnes = [self.normalize_header(h) for h in header]
+            position = max(offset, raw.tell())
+            raw.seek(position)
+            lecture['offset'] = position
+            f = io.TextIOWrapper(raw, encoding='cp1252', errors='replace', newline='')
+
+            def lignes():
+                nonlocal position
+                for ligne in f:
+                    position += len(ligne)
+                    yield ligne
+
+            # Temps de lecture/découpage CSV isolé du temps de transformation passé chez l'appelant
+            reader = csv.reader(lignes(), delimiter=';')
+            while True:
+                t0 = time.perf_counter()
+                valeurs = next(reader, None)
+                if valeurs is None:
+                    lecture['duree_parse_s'] += time.perf_counter() - t0
+                    break
+                row = dict(zip(colonnes, valeurs))
+                lecture['duree_parse_s'] += time.perf_counter() - t0
+                lecture['offset'] = position
+                lecture['lignes'] += 1
+                yield row
+            lecture['offset'] = position
+
+    @staticmethod
+    def file_fingerprint(csv_path: str, offset: int, bloc: int = CHECKPOINT_BLOC) -> str:
+        # Empreinte SHA-256 de tout le préfixe déjà consommé, lu par blocs : une correction en place
+        # (même longueur) est détectée, pour un coût de simple lecture bien inférieur au parsing CSV
+        h = hashlib.sha256(str(offset).encode())
+        reste = offset
+        with open(csv_path, 'rb') as f:
+            while reste > 0:
+                donnees = f.read(min(bloc, reste))
+                if not donnees:
+                    break
+                h.update(donnees)
+                reste -= len(donnees)
+        return h.hexdigest()
+
+    def checkpoint_offset(self, type_sync: str, csv_path: str) -> int:
+        checkpoint = self.db.load_sync_checkpoint(type_sync)
+        if not checkpoint or not checkpoint['offset']:
+            return 0
+        if os.path.getsize(csv_path) < checkpoint['offset'] or \
+                self.file_fingerprint(csv_path, checkpoint['offset']) != checkpoint['empreinte']:
+            # Préfixe modifié : relecture complète, lignes connues ignorées ou corrigées via les index uniques
+            print(f"{type_sync}: fichier modifié depuis la dernière synchro, relecture complète")
+            return 0
+        return checkpoint['offset']
+
+    def save_checkpoint(self, type_sync: str, csv_path: str, depart: int, lecture: dict):
+        nb_lignes = lecture['lignes']
+        if depart:
+            nb_lignes += self.db.load_sync_checkpoint(type_sync)['nb_lignes']
+        offset = lecture['offset'] or depart
+        self.db.save_sync_checkpoint(type_sync, os.path.basename(csv_path), offset, nb_lignes,
+                                     self.file_fingerprint(csv_path, offset))
+
+    def bulk_insert(self, fichier: str, sql: str, params, lecture: dict, batch_size: int = IMPORT_BATCH_SIZE) -> int:
+        # Trois étapes mesurées : parse (lecture CSV, cf. iter_csv), transform (construction des tuples), insert
+        cursor = self.db.conn.cursor()
+        count = 0
+        duree_insert = 0.0
+        t0 = time.perf_counter()
+        batch = []
+        try:
+            for p in params:
+                batch.append(p)
+                if len(batch) >= batch_size:
+                    t = time.perf_counter()
+                    cursor.executemany(sql, batch)
+                    duree_insert += time.perf_counter() - t
+                    count += cursor.rowcount
+                    batch = []
+                    if self.progress:
+                        self.progress(fichier, count)
+            if batch:
+                t = time.perf_counter()
+                cursor.executemany(sql, batch)
+                duree_insert += time.perf_counter() - t
+                count += cursor.rowcount
+            if self.progress:
+                self.progress(fichier, count)
+        finally:
+            duree_parse = lecture.get('duree_parse_s', 0.0)
+            duree_transform = max(0.0, time.perf_counter() - t0 - duree_insert - duree_parse)
+            self.last_stats[fichier] = {
+                'lignes': count,
+                'duree_parse_s': round(duree_parse, 4),
+                'duree_transform_s': round(duree_transform, 4),
+                'duree_insert_s': round(duree_insert, 4),
+                'parse_lignes_par_seconde': round(lecture.get('lignes', 0) / duree_parse, 1) if duree_parse > 0 else 0.0,
+                'insert_lignes_par_seconde': round(count / duree_insert, 1) if duree_insert > 0 else 0.0,
+            }
+            for etape, duree in (('parse', duree_parse), ('transform', duree_transform), ('insert', duree_insert)):
+                registry.observe('import_stage_seconds', duree, fichier=fichier, etape=etape)
+            registry.inc('import_rows_total', count, fichier=fichier)
+            print(f"{fichier}: parse {duree_parse:.2f}s ({self.last_stats[fichier]['parse_lignes_par_seconde']:.0f} lignes/s), "
+                  f"transform {duree_transform:.2f}s, "
+                  f"insert {duree_insert:.2f}s ({self.last_stats[fichier]['insert_lignes_par_seconde']:.0f} lignes/s)")
+        return count
+
+    @contextmanager
+    def stage(self, fichier: str, etape: str):
+        # Étape complémentaire d'un import (index, agrégats...), ajoutée aux durées du fichier
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            duree = time.perf_counter() - t0
+            self.last_stats.setdefault(fichier, {})[f'duree_{etape}_s'] = round(duree, 4)
+            registry.observe('import_stage_seconds', duree, fichier=fichier, etape=etape)
+
+    @contextmanager
+    def import_transaction(self, type_sync: str, touches: set):
+        # Import d'un fichier en une transaction : lignes, agrégats, index et point de reprise validés ensemble,
+        # rien n'est conservé si une étape échoue (resultat['count'] est alors remis à 0)
+        resultat = {'count': 0}
+        with self.db.bulk_import():
+            try:
+                yield resultat
+            except Exception as e:
+                self.db.conn.rollback()
+                resultat['count'] = 0
+                print(f"Erreur import {type_sync}: {e} (import annulé)")
+            else:
+                self.matricules_modifies |= touches
+                self.db.mark_matricules_modifies(touches)
+                if resultat['count'] > 0:
+                    self.db.bump_generation()
+                self.db.conn.commit()
+
+    def log_sync(self, type_sync: str, fichier: str, dernier_nbsi, count: int):
+        self.db.log_sync(type_sync, dernier_nbsi, count, 'Import réussi', self.last_stats.get(fichier, {}))
+
     def import_matrice(self, csv_path: str) -> int:
         if not os.path.exists(csv_path):
             print(f"FICHIER MANQUANT: {csv_path}")
             return 0
-        cursor = self.db.conn.cursor()
         count = 0
-        try:
-            with open(csv_path, 'r', encoding='cp1252', errors='replace') as f:
-                reader = csv.DictReader(f, delimiter=';')  # ← AJOUT
-                reader.fieldnames = [self.normalize_header(h) for h in reader.fieldnames]
-                for row in reader:
-                    row = {self.normalize_header(k): v for k, v in row.items()}
-                    matricule = self.safe_str(row.get('matricule'))
-                    if not matricule:
-                        continue
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO Matricules 
-                        (matricule, designation, annee, qte_vidange, code_barre, marque, pneumatique, categorie)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        matricule,
-                        self.safe_str(row.get('designation')),
-                        self.safe_int(row.get('annee')),
-                        self.safe_int(row.get('qte_vidange'), 0),
-                        self.safe_str(row.get('code_barre')),
-                        self.safe_str(row.get('marque')),
-                        self.safe_str(row.get('pneumatique')),
-                        self.safe_str(row.get('categorie'))
-                    ))
-                    count += 1
-        except Exception as e:
-            print(f"Erreur lecture {csv_path}: {e}")
-        self.db.conn.commit()
+        touches = set()
+        fichier = os.path.basename(csv_path)
+        lecture = {'offset': 0, 'lignes': 0}
+        # Seules les fiches nouvelles ou modifiées sont écrites et marquées pour la planification incrémentale
+        existants = {
+            row[0]: tuple(row)
+            for row in self.db.conn.execute(
+                "SELECT matricule, designation, annee, qte_vidange, code_barre, marque, pneumatique, categorie FROM Matricules")
+        }
+
+        def lignes():
+            for row in self.iter_csv(csv_path, lecture=lecture):
+                matricule = self.safe_str(row.get('matricule'))
+                if not matricule:
+                    continue
+                valeurs = (
+                    matricule,
+                    self.safe_str(row.get('designation')),
+                    self.safe_int(row.get('annee')),
+                    self.safe_int(row.get('qte_vidange'), 0),
+                    self.safe_str(row.get('code_barre')),
+                    self.safe_str(row.get('marque')),
+                    self.safe_str(row.get('pneumatique')),
+                    self.safe_str(row.get('categorie'))
+                )
+                if existants.get(matricule) == valeurs:
+                    continue
+                existants[matricule] = valeurs
+                touches.add(matricule)
+                yield valeurs
+
+        with self.import_transaction('MATRICE', touches) as resultat:
+            resultat['count'] = count = self.bulk_insert(fichier, """
+                INSERT OR REPLACE INTO Matricules 
+                (matricule, designation, annee, qte_vidange, code_barre, marque, pneumatique, categorie)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, lignes(), lecture)
+            if count > 0:
+                # INSERT OR REPLACE réattribue les rowid : index des matricules reconstruit en entier
+                with self.stage(fichier, 'recherche'):
+                    self.db.rebuild_search_index('Recherche_Matricules')
+                self.log_sync('MATRICE', fichier, None, count)
+        count = resultat['count']
         print(f"{count} matricules importés")
         return count
 
@@ -173,60 +639,61 @@ class DataImporter:
         if not os.path.exists(csv_path):
             print(f"FICHIER MANQUANT: {csv_path}")
             return 0
-        cursor = self.db.conn.cursor()
         count = 0
-        dernier_nbsi = None
-        if incremental:
-            cursor.execute("SELECT dernier_nbsi FROM Sync_Log WHERE type_sync='VIDANGE' ORDER BY date_sync DESC LIMIT 1")
-            result = cursor.fetchone()
-            dernier_nbsi = result[0] if result else None
-        try:
-            with open(csv_path, 'r', encoding='cp1252', errors='replace') as f:
-                reader = csv.DictReader(f, delimiter=';')  # ← AJOUT
-                reader.fieldnames = [self.normalize_header(h) for h in reader.fieldnames]
-                for row in reader:
-                    row = {self.normalize_header(k): v for k, v in row.items()}
-                    nb_si = self.safe_str(row.get('nbsi'))
-                    if not nb_si:
-                        continue
-                    if incremental and dernier_nbsi and nb_si <= dernier_nbsi:
-                        continue
-                    matricule = self.safe_str(row.get('matricule'))
-                    if not matricule:
-                        continue
-                    date_realisation = self.safe_date(row.get('date'))
-                    if not date_realisation:
-                        continue
-                    entretiens = []
-                    if self.safe_str(row.get('entretien')) == 'VIDANGE,M':
-                        entretiens.append('Vidanger le carter moteur')
-                    if self.safe_str(row.get('f/h')) == '*':
-                        entretiens.append('Filtre à huile')
-                    if self.safe_str(row.get('f/g')) == '*':
-                        entretiens.append('Filtre carburant')
-                    if self.safe_str(row.get('f/air')) == '*':
-                        entretiens.append('Filtre à air')
-                    if self.safe_str(row.get('f/hyd')) == '*':
-                        entretiens.append('Filtre hydraulique')
-                    if self.safe_str(row.get('entretien')) == 'GR' or self.safe_float(row.get('gr')):
-                        entretiens.append('Graissage général')
-                    for e in entretiens:
-                        cursor.execute("""
-                            INSERT INTO Historique_Preventif 
-                            (matricule, nom_entretien, type_intervention, date_realisation, 
-                             compteur_km_h, observations, source_fichier, nb_si)
-                            VALUES (?, ?, 'CH', ?, ?, ?, 'VIDANGE.csv', ?)
-                        """, (
-                            matricule, e, date_realisation,
-                            self.safe_float(row.get('compteur_km/h')),
-                            self.safe_str(row.get('obs')), nb_si
-                        ))
-                        count += 1
+        touches = set()
+        realisations = {}
+        fichier = os.path.basename(csv_path)
+        etat = {'nb_si': None}
+        lecture = {'offset': 0, 'lignes': 0}
+        depart = self.checkpoint_offset('VIDANGE', csv_path) if incremental else 0
+
+        def lignes():
+            for row in self.iter_csv(csv_path, depart, lecture):
+                nb_si = self.safe_str(row.get('nbsi'))
+                if not nb_si:
+                    continue
+                etat['nb_si'] = nb_si
+                matricule = self.safe_str(row.get('matricule'))
+                if not matricule:
+                    continue
+                date_realisation = self.safe_date(row.get('date'))
+                if not date_realisation:
+                    continue
+                entretiens = []
+                if self.safe_str(row.get('entretien')) == 'VIDANGE,M':
+                    entretiens.append('Vidanger le carter moteur')
+                if self.safe_str(row.get('f/h')) == '*':
+                    entretiens.append('Filtre à huile')
+                if self.safe_str(row.get('f/g')) == '*':
+                    entretiens.append('Filtre carburant')
+                if self.safe_str(row.get('f/air')) == '*':
+                    entretiens.append('Filtre à air')
+                if self.safe_str(row.get('f/hyd')) == '*':
+                    entretiens.append('Filtre hydraulique')
+                if self.safe_str(row.get('entretien')) == 'GR' or self.safe_float(row.get('gr')):
+                    entretiens.append('Graissage général')
+                compteur = self.safe_float(row.get('compteur_km/h'))
+                obs = self.safe_str(row.get('obs'))
+                for e in entretiens:
+                    touches.add(matricule)
+                    cle = (matricule, e, 'CH')
+                    if cle not in realisations or date_realisation > realisations[cle][0]:
+                        realisations[cle] = (date_realisation, 'VIDANGE.csv')
+                    yield (matricule, e, date_realisation, compteur, obs, nb_si)
+
+        with self.import_transaction('VIDANGE', touches) as resultat:
+            resultat['count'] = count = self.bulk_insert(fichier, """
+                INSERT OR IGNORE INTO Historique_Preventif 
+                (matricule, nom_entretien, type_intervention, date_realisation, 
+                 compteur_km_h, observations, source_fichier, nb_si)
+                VALUES (?, ?, 'CH', ?, ?, ?, 'VIDANGE.csv', ?)
+            """, lignes(), lecture)
+            with self.stage(fichier, 'derniere_intervention'):
+                self.db.update_derniere_intervention(realisations)
             if count > 0:
-                cursor.execute("INSERT INTO Sync_Log (type_sync, dernier_nbsi, nb_lignes_ajoutees, statut, message) VALUES ('VIDANGE', ?, ?, 'SUCCESS', 'Import réussi')", (nb_si, count))
-        except Exception as e:
-            print(f"Erreur import VIDANGE: {e}")
-        self.db.conn.commit()
+                self.log_sync('VIDANGE', fichier, etat['nb_si'], count)
+            self.save_checkpoint('VIDANGE', csv_path, depart, lecture)
+        count = resultat['count']
         print(f"{count} entretiens préventifs importés")
         return count
 
@@ -236,71 +703,78 @@ class DataImporter:
             return 0
         cursor = self.db.conn.cursor()
         count = 0
-        dernier_nbsi = None
-        if incremental:
-            cursor.execute("SELECT dernier_nbsi FROM Sync_Log WHERE type_sync='CURATIF' ORDER BY date_sync DESC LIMIT 1")
-            result = cursor.fetchone()
-            dernier_nbsi = result[0] if result else None
-        try:
-            with open(csv_path, 'r', encoding='cp1252', errors='replace') as f:
-                reader = csv.DictReader(f, delimiter=';')  # ← AJOUT
-                reader.fieldnames = [self.normalize_header(h) for h in reader.fieldnames]
-                for row in reader:
-                    row = {self.normalize_header(k): v for k, v in row.items()}
-                    nb_si = self.safe_str(row.get('nbsi'))
-                    if not nb_si:
-                        continue
-                    if incremental and dernier_nbsi and nb_si <= dernier_nbsi:
-                        continue
-                    matricule = self.safe_str(row.get('matricule'))
-                    if not matricule:
-                        continue
-                    date_entree = self.safe_date(row.get('date_entree'))
-                    date_sortie = self.safe_date(row.get('date_sortie'))
-                    cursor.execute("""
-                        INSERT INTO Historique_Curatif 
-                        (matricule, categorie, designation, date_entree, panne_declaree, 
-                         situation_actuelle, pieces, date_sortie, intervenant, affectation,
-                         nb_indisponibilite, jour_ouvrable, type_panne, nb_si)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        matricule,
-                        self.safe_str(row.get('categorie')),
-                        self.safe_str(row.get('designation')),
-                        date_entree,
-                        self.safe_str(row.get('panne_declaree')),
-                        self.safe_str(row.get('sit_actuelle')),
-                        self.safe_str(row.get('pieces')),
-                        date_sortie,
-                        self.safe_str(row.get('intervenant')),
-                        self.safe_str(row.get('affectation')),
-                        self.safe_int(row.get('nbr_indisponibilite')),
-                        self.safe_int(row.get('jour_ouvrable')),
-                        self.safe_str(row.get('type_de_panne')),
-                        nb_si
-                    ))
-                    count += 1
+        touches = set()
+        fichier = os.path.basename(csv_path)
+        etat = {'nb_si': None}
+        lecture = {'offset': 0, 'lignes': 0}
+        depart = self.checkpoint_offset('CURATIF', csv_path) if incremental else 0
+
+        def lignes():
+            for row in self.iter_csv(csv_path, depart, lecture):
+                nb_si = self.safe_str(row.get('nbsi'))
+                if not nb_si:
+                    continue
+                etat['nb_si'] = nb_si
+                matricule = self.safe_str(row.get('matricule'))
+                if not matricule:
+                    continue
+                touches.add(matricule)
+                yield (
+                    matricule,
+                    self.safe_str(row.get('categorie')),
+                    self.safe_str(row.get('designation')),
+                    self.safe_date(row.get('date_entree')),
+                    self.safe_str(row.get('panne_declaree')),
+                    self.safe_str(row.get('sit_actuelle')),
+                    self.safe_str(row.get('pieces')),
+                    self.safe_date(row.get('date_sortie')),
+                    self.safe_str(row.get('intervenant')),
+                    self.safe_str(row.get('affectation')),
+                    self.safe_int(row.get('nbr_indisponibilite')),
+                    self.safe_int(row.get('jour_ouvrable')),
+                    self.safe_str(row.get('type_de_panne')),
+                    nb_si
+                )
+
+        with self.import_transaction('CURATIF', touches) as resultat:
+            dernier_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM Historique_Curatif").fetchone()[0]
+            # Une ligne déjà importée puis corrigée dans le fichier (date de sortie renseignée...) est mise à jour
+            resultat['count'] = count = self.bulk_insert(fichier, f"""
+                INSERT INTO Historique_Curatif 
+                (matricule, categorie, designation, date_entree, panne_declaree, 
+                 situation_actuelle, pieces, date_sortie, intervenant, affectation,
+                 nb_indisponibilite, jour_ouvrable, type_panne, nb_si)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (nb_si) DO UPDATE SET
+                {', '.join(f"{c} = excluded.{c}" for c in CURATIF_COLONNES)}
+                WHERE {' OR '.join(f"{c} IS NOT excluded.{c}" for c in CURATIF_COLONNES)}
+            """, lignes(), lecture)
             if count > 0:
-                cursor.execute("INSERT INTO Sync_Log (type_sync, dernier_nbsi, nb_lignes_ajoutees, statut, message) VALUES ('CURATIF', ?, ?, 'SUCCESS', 'Import réussi')", (nb_si, count))
-        except Exception as e:
-            print(f"Erreur import CURATIF: {e}")
-        self.db.conn.commit()
+                nouveaux = cursor.execute("SELECT COUNT(*) FROM Historique_Curatif WHERE id > ?", (dernier_id,)).fetchone()[0]
+                with self.stage(fichier, 'immobilisations'):
+                    PlanningGenerator(self.db).apply_curative_downtime(touches)
+                if count > nouveaux:
+                    # Lignes existantes corrigées : les cumuls et l'index de recherche sont recalculés
+                    print(f"{count - nouveaux} entretiens curatifs corrigés")
+                    with self.stage(fichier, 'kpis'):
+                        self.db.rebuild_kpis()
+                    with self.stage(fichier, 'recherche'):
+                        self.db.rebuild_search_index('Recherche_Curatif')
+                else:
+                    with self.stage(fichier, 'kpis'):
+                        self.db.update_kpis(dernier_id)
+                    with self.stage(fichier, 'recherche'):
+                        self.db.index_curatif(dernier_id)
+                self.log_sync('CURATIF', fichier, etat['nb_si'], count)
+            self.save_checkpoint('CURATIF', csv_path, depart, lecture)
+        count = resultat['count']
         print(f"{count} entretiens curatifs importés")
         return count
 
     def initialize_exclusions(self):
         cursor = self.db.conn.cursor()
-        exclusions_data = {
-            "GEG": ["frein", "chaine", "pneu", "moyeu de roue", "graissage général", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
-            "AIR COMPRIME": ["frein", "chaine", "pneu", "moyeu de roue", "graissage général", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "faisceaux électriques"],
-            "LEGER": ["graissage général", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
-            "TRANS/MARCHANDISE 1": ["niveau d'huile du carter", "etanchéité des circuits", "courroie", "filtre à huile", "vidanger le carter moteur", "filtre à air", "filtre carburant", "chaine", "soupape", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "alternateur", "batterie", "faisceaux électriques"],
-            "TRANS ET V, SPECIAUX 1": ["niveau d'huile du carter", "etanchéité des circuits", "courroie", "filtre à huile", "vidanger le carter moteur", "filtre à air", "filtre carburant", "chaine", "soupape", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "alternateur", "batterie", "faisceaux électriques"],
-            "TRANS/PERSONNEL": ["niveau d'huile du carter", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
-            "TRANS/BENNE.R": ["embrayage", "chaine", "boite de vitesse", "alternateur", "faisceaux électriques"]
-        }
         count = 0
-        for categorie, exclusions in exclusions_data.items():
+        for categorie, exclusions in EXCLUSIONS_DEFAUT.items():
             for entretien in exclusions:
                 cursor.execute("INSERT OR IGNORE INTO Exclusions (categorie, entretien_exclu) VALUES (?, ?)", (categorie, entretien))
                 count += 1
@@ -310,77 +784,579 @@ class DataImporter:
 # =============================================================================
 # 3. PLANNING
 # =============================================================================
+ENTRETIENS_DEFAUT = [
+    "Niveau d'huile du carter", "Etanchéité de tous les circuits", "Frein", "courroie",
+    "Filtre à huile", "Vidanger le carter moteur", "Filtre à air", "Filtre carburant",
+    "chaine", "soupape", "Graissage général", "moyeu de roue", "pneu", "boite de vitesse",
+    "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "Filtre hydraulique",
+    "Réservoir hydraulique", "alternateur", "batterie", "Faisceaux électriques"
+]
+
+# Repli quand Param.csv est absent : intervalles uniformes de l'ancienne version
+INTERVALLES_DEFAUT = {'C': 30, 'N': 90, 'CH': 180}
+
+# Les catégories de matériel ne figurent pas dans Param.csv : exclusions par catégorie (noms en minuscules)
+EXCLUSIONS_DEFAUT = {
+    "GEG": ["frein", "chaine", "pneu", "moyeu de roue", "graissage général", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
+    "AIR COMPRIME": ["frein", "chaine", "pneu", "moyeu de roue", "graissage général", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "faisceaux électriques"],
+    "LEGER": ["graissage général", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
+    "TRANS/MARCHANDISE 1": ["niveau d'huile du carter", "etanchéité des circuits", "courroie", "filtre à huile", "vidanger le carter moteur", "filtre à air", "filtre carburant", "chaine", "soupape", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "alternateur", "batterie", "faisceaux électriques"],
+    "TRANS ET V, SPECIAUX 1": ["niveau d'huile du carter", "etanchéité des circuits", "courroie", "filtre à huile", "vidanger le carter moteur", "filtre à air", "filtre carburant", "chaine", "soupape", "boite de vitesse", "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "alternateur", "batterie", "faisceaux électriques"],
+    "TRANS/PERSONNEL": ["niveau d'huile du carter", "circuit hydraulique", "pompe hydraulique", "filtre hydraulique", "réservoir hydraulique", "faisceaux électriques"],
+    "TRANS/BENNE.R": ["embrayage", "chaine", "boite de vitesse", "alternateur", "faisceaux électriques"]
+}
+
+DATE_REFERENCE_DEFAUT = datetime(2010, 1, 1).date()
+
+# Tâches préventives tombant pendant une immobilisation curative : 'annuler' (N/CH en annule_curatif,
+# contrôles décalés) ou 'decaler' (toutes décalées à la date de sortie d'atelier)
+CURATIF_POLITIQUE = 'annuler'
+
+PLANNING_LOTS_PAR_WORKER = 4
+PLANNING_PARALLEL_MIN_MATRICULES = 500
+
+
+# Fiche d'entretien préventif : colonnes repérées par leurs en-têtes, positions de la fiche d'origine par défaut
+PARAM_FLAGS = ('C', 'N', 'CH')
+PARAM_GROUPES = {'C': 'contr', 'N': 'nettoyage', 'CH': 'changement'}
+PARAM_COLONNES_DEFAUT = {'operation': 5, 'flags': 6, 'periodes': 0, 'C': 10, 'N': 16, 'CH': 22}
+PARAM_LARGEUR_GROUPE = 5
+REGLES_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+def parse_param_sheet(path: str) -> dict:
+    # {entretien: {type: intervalle}} ; plusieurs intervalles pour un même type -> le plus court.
+    # Type coché sans intervalle dans son bloc : intervalle saisi dans un bloc non coché de la même ligne,
+    # sinon période cochée en tête de ligne (7/30/90/180/360)
+    with open(path, 'r', encoding='cp1252', newline='') as f:
+        lignes = [[cell.strip() for cell in row] for row in csv.reader(f, delimiter=';')]
+    colonnes = dict(PARAM_COLONNES_DEFAUT)
+    periodes = []
+    for row in lignes:
+        textes = [cell.lower() for cell in row]
+        if 'contrôler' in textes or 'controler' in textes:
+            colonnes['flags'] = textes.index('contrôler' if 'contrôler' in textes else 'controler')
+            colonnes['operation'] = colonnes['flags'] - 1
+        elif not periodes and row and row[0].isdigit():
+            periodes = [int(cell) for cell in row if cell.isdigit()]
+        elif any(cell.startswith('changement') for cell in textes) and not any(cell in PARAM_FLAGS for cell in row):
+            for type_interv, prefixe in PARAM_GROUPES.items():
+                colonnes[type_interv] = next(i for i, cell in enumerate(textes) if cell.startswith(prefixe))
+
+    def valeur(row, i):
+        return int(row[i]) if i < len(row) and row[i].isdigit() else None
+
+    regles = {}
+    for row in lignes:
+        operation = row[colonnes['operation']] if len(row) > colonnes['operation'] else ''
+        flags = {row[colonnes['flags'] + k] for k in range(len(PARAM_FLAGS)) if colonnes['flags'] + k < len(row)}
+        coches = [t for t in PARAM_FLAGS if t in flags]
+        if not operation or not coches or operation in regles:
+            continue
+        blocs = {
+            t: [v for v in (valeur(row, colonnes[t] + k) for k in range(PARAM_LARGEUR_GROUPE)) if v]
+            for t in PARAM_FLAGS
+        }
+        orphelins = [v for t in PARAM_FLAGS if t not in coches for v in blocs[t]]
+        etoiles = [p for k, p in enumerate(periodes) if colonnes['periodes'] + k < len(row) and row[colonnes['periodes'] + k] == '*']
+        types = {}
+        for t in coches:
+            candidats = blocs[t] or orphelins or etoiles
+            if candidats:
+                types[t] = min(candidats)
+            else:
+                print(f"Param.csv : pas d'intervalle pour {operation} ({t}), règle ignorée")
+        if types:
+            regles[operation] = types
+    return regles
+
+
+def load_param_rules(path: str, cache_dir: str = REGLES_CACHE_DIR):
+    # Règles mises en cache sur disque sous l'empreinte du fichier : pas de re-parsing tant que Param.csv ne change pas
+    with open(path, 'rb') as f:
+        empreinte = hashlib.sha1(f.read()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"regles-{empreinte}.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f), empreinte
+    except (OSError, ValueError):
+        pass
+    regles = parse_param_sheet(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for ancien in os.listdir(cache_dir):
+            if ancien.startswith('regles-') and ancien.endswith('.json'):
+                os.remove(os.path.join(cache_dir, ancien))
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(regles, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"Cache des règles non écrit : {e}")
+    return regles, empreinte
+
+
+class RuleMatrix:
+    # Matrice compilée catégorie -> (entretien, type, intervalle), exclusions déjà appliquées :
+    # une consultation de dictionnaire par matricule au lieu de filtrer chaque entretien
+    def __init__(self, regles: dict, exclusions: dict):
+        self.defaut = tuple(
+            (entretien, type_interv, intervalle)
+            for entretien, types in regles.items()
+            for type_interv, intervalle in types.items()
+            if type_interv in PLANNING_TYPES and intervalle and intervalle > 0
+        )
+        self.par_categorie = {
+            categorie: tuple(r for r in self.defaut if r[0].lower() not in exclus)
+            for categorie, exclus in exclusions.items()
+        }
+
+    def rules_for(self, categorie) -> tuple:
+        return self.par_categorie.get(categorie, self.defaut)
+
+    def __len__(self):
+        return len(self.defaut)
+
+
+class IntervalIndex:
+    # Immobilisations curatives par matricule : intervalles [entrée, sortie] fusionnés et triés,
+    # recherche dichotomique d'une date en O(log k) au lieu de comparer chaque ligne à chaque panne
+    def __init__(self):
+        self.debuts = {}
+        self.fins = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        par_matricule = {}
+        for matricule, entree, sortie in rows:
+            par_matricule.setdefault(matricule, []).append((entree, sortie))
+        index = cls()
+        for matricule, intervalles in par_matricule.items():
+            intervalles.sort()
+            debuts, fins = [], []
+            for entree, sortie in intervalles:
+                if fins and entree <= fins[-1] + timedelta(days=1):
+                    fins[-1] = max(fins[-1], sortie)
+                else:
+                    debuts.append(entree)
+                    fins.append(sortie)
+            index.debuts[matricule] = debuts
+            index.fins[matricule] = fins
+        return index
+
+    def __len__(self):
+        return len(self.debuts)
+
+    def matricules(self):
+        return self.debuts.keys()
+
+    def subset(self, matricules):
+        index = IntervalIndex()
+        for m in matricules:
+            if m in self.debuts:
+                index.debuts[m] = self.debuts[m]
+                index.fins[m] = self.fins[m]
+        return index
+
+    def bounds(self, matricule):
+        return self.debuts[matricule][0], self.fins[matricule][-1]
+
+    def find(self, matricule, d):
+        debuts = self.debuts.get(matricule)
+        if not debuts:
+            return None
+        i = bisect_right(debuts, d) - 1
+        if i >= 0 and self.fins[matricule][i] >= d:
+            return debuts[i], self.fins[matricule][i]
+        return None
+
+
 class PlanningGenerator:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, progress=None, param_path: Optional[str] = None):
         self.db = db
+        self.progress = progress
+        self.param_path = param_path or os.path.join(DATA_DIR, "Param.csv")
+        self.politique_curatif = CURATIF_POLITIQUE
+        self.last_stats = {}
+        self.phases = {}
+        self.t_phase = None
+
+    def start_phases(self):
+        self.phases = {}
+        self.t_phase = time.perf_counter()
+
+    def phase(self, nom: str, duree: Optional[float] = None):
+        # Clôt la phase nom : durée écoulée depuis la phase précédente (ou durée mesurée par l'appelant)
+        maintenant = time.perf_counter()
+        if duree is None:
+            duree = maintenant - self.t_phase
+            self.t_phase = maintenant
+        self.phases[nom] = round(self.phases.get(nom, 0.0) + duree, 4)
+        registry.observe('planning_phase_seconds', duree, phase=nom)
+
+    def load_rules(self) -> dict:
+        if not os.path.exists(self.param_path):
+            print(f"{self.param_path} introuvable : intervalles par défaut")
+            return {e: dict(INTERVALLES_DEFAUT) for e in ENTRETIENS_DEFAUT}
+        regles, empreinte = load_param_rules(self.param_path)
+        self.sync_parametrage(regles, empreinte)
+        return regles
+
+    def sync_parametrage(self, regles: dict, empreinte: str):
+        # Parametrage reflète la fiche : réécrit uniquement quand l'empreinte de Param.csv a changé
+        etat = self.db.load_sync_checkpoint('PARAM')
+        if etat and etat['empreinte'] == empreinte:
+            return
+        cursor = self.db.conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO Entretiens_Types (nom) VALUES (?)", [(e,) for e in regles])
+        cursor.execute("DELETE FROM Parametrage")
+        cursor.executemany(
+            "INSERT INTO Parametrage (entretien_nom, type_intervention, intervalle_jours) VALUES (?, ?, ?)",
+            [(e, t, intervalle) for e, types in regles.items() for t, intervalle in types.items()]
+        )
+        self.db.save_sync_checkpoint('PARAM', os.path.basename(self.param_path), 0, len(regles), empreinte)
+        print(f"{len(regles)} opérations chargées depuis {os.path.basename(self.param_path)}")
+
+    def load_rule_matrix(self) -> RuleMatrix:
+        return RuleMatrix(self.load_rules(), self.load_exclusions())
+
+    def load_exclusions(self) -> dict:
+        cursor = self.db.conn.cursor()
+        cursor.execute("SELECT categorie, entretien_exclu FROM Exclusions")
+        exclusions = {}
+        for categorie, entretien in cursor.fetchall():
+            exclusions.setdefault(categorie, set()).add(entretien.lower())
+        return exclusions
 
-    def generate_planning_for_year(self, annee: int):
+    @staticmethod
+    def occurrences(reference, intervalle: int, debut, fin):
+        # Première occurrence >= debut calculée directement, sans parcourir les années précédentes
+        ecart = (debut - reference).days
+        k = max(1, -(-ecart // intervalle))
+        current_date = reference + timedelta(days=k * intervalle)
+        pas = timedelta(days=intervalle)
+        while current_date <= fin:
+            yield current_date
+            current_date += pas
+
+    @staticmethod
+    def curative_adjustment(type_interv: str, d, entree, sortie, politique: str, deja_decale: bool = False):
+        # Renvoie (date_prevue, statut, observations) d'une tâche tombant pendant une immobilisation,
+        # None si la tâche disparaît (type C déjà décalé pour cette immobilisation)
+        if politique == 'annuler' and type_interv != 'C':
+            return d, 'annule_curatif', f"Immobilisation curative du {entree} au {sortie}"
+        # Une seule occurrence décalée par immobilisation : les suivantes sont absorbées par celle-ci
+        if deja_decale:
+            if type_interv == 'C':
+                return None
+            return d, 'annule_curatif', f"Absorbé par le décalage au {sortie} (immobilisation curative du {entree})"
+        # Le décalage reste dans l'année de l'occurrence pour ne pas sortir de sa plage de suppression
+        nouvelle_date = min(sortie, datetime(d.year, 12, 31).date())
+        return nouvelle_date, 'a_faire', f"Décalé du {d} (immobilisation curative jusqu'au {sortie})"
+
+    def compute_rows(self, matricules, debut, fin, regles: RuleMatrix, dernieres: dict,
+                     immobilisations: Optional[IntervalIndex] = None) -> list:
+        rows = []
+        for matricule_id, categorie in matricules:
+            curatif = immobilisations is not None and matricule_id in immobilisations.debuts
+            for entretien, type_interv, intervalle in regles.rules_for(categorie):
+                derniere_date, source = dernieres.get((matricule_id, entretien, type_interv), (DATE_REFERENCE_DEFAUT, 'default'))
+                if not curatif:
+                    rows.extend(
+                        (type_interv, matricule_id, entretien, d, derniere_date, source, 'a_faire', None)
+                        for d in self.occurrences(derniere_date, intervalle, debut, fin)
+                    )
+                    continue
+                decales = set()
+                for d in self.occurrences(derniere_date, intervalle, debut, fin):
+                    immobilisation = immobilisations.find(matricule_id, d)
+                    if immobilisation:
+                        cle = (immobilisation, d.year)
+                        ajustement = self.curative_adjustment(type_interv, d, *immobilisation, self.politique_curatif, cle in decales)
+                        if ajustement is None:
+                            continue
+                        date_prevue, statut, obs = ajustement
+                        if statut == 'a_faire':
+                            decales.add(cle)
+                    else:
+                        date_prevue, statut, obs = d, 'a_faire', None
+                    rows.append((type_interv, matricule_id, entretien, date_prevue, derniere_date, source, statut, obs))
+        return rows
+
+    def apply_curative_downtime(self, matricules=None) -> int:
+        # Après un import curatif : ajuste les tâches 'a_faire' déjà planifiées qui tombent pendant une immobilisation
+        index = IntervalIndex.from_rows(self.db.load_immobilisations(matricules))
         cursor = self.db.conn.cursor()
-        cursor.execute("SELECT * FROM Matricules")
-        matricules = cursor.fetchall()
+        annulations, decalages, suppressions = [], [], []
+        for matricule in index.matricules():
+            debut, fin = index.bounds(matricule)
+            cursor.execute("SELECT id, type_intervention, nom_entretien, date_prevue FROM Planning WHERE matricule = ? AND statut = 'a_faire' AND date_prevue >= ? AND date_prevue <= ? ORDER BY date_prevue, id",
+                           (matricule, debut, fin))
+            decales = set()
+            for id_planning, type_interv, entretien, date_prevue in cursor.fetchall():
+                d = datetime.strptime(str(date_prevue)[:10], '%Y-%m-%d').date()
+                immobilisation = index.find(matricule, d)
+                if not immobilisation:
+                    continue
+                cle = (entretien, type_interv, immobilisation, d.year)
+                ajustement = self.curative_adjustment(type_interv, d, *immobilisation, self.politique_curatif, cle in decales)
+                if ajustement is None:
+                    suppressions.append((id_planning,))
+                    continue
+                nouvelle_date, statut, obs = ajustement
+                if statut == 'annule_curatif':
+                    annulations.append((obs, id_planning))
+                else:
+                    decales.add(cle)
+                    # Tâche déjà placée à la sortie d'atelier : l'observation d'origine est conservée
+                    if nouvelle_date != d:
+                        decalages.append((nouvelle_date, obs, id_planning))
+        cursor.executemany("UPDATE Planning SET statut = 'annule_curatif', observations = ? WHERE id = ?", annulations)
+        cursor.executemany("UPDATE Planning SET date_prevue = ?, observations = ? WHERE id = ?", decalages)
+        cursor.executemany("DELETE FROM Planning WHERE id = ?", suppressions)
+        total = len(annulations) + len(decalages) + len(suppressions)
+        if total:
+            print(f"{len(annulations)} tâches annulées, {len(decalages)} décalées, {len(suppressions)} supprimées (immobilisations curatives)")
+        return total
+
+    def generate_planning_for_year(self, annee: int, incremental: bool = False):
+        t0 = time.perf_counter()
+        self.start_phases()
+        conn = self.db.conn
+        cursor = conn.cursor()
         debut_annee = datetime(annee, 1, 1).date()
         fin_annee = datetime(annee, 12, 31).date()
-        for table in ['Planning_Controle', 'Planning_Nettoyage', 'Planning_Changement']:
-            cursor.execute(f"DELETE FROM {table} WHERE date_prevue BETWEEN ? AND ?", (debut_annee, fin_annee))
+        # Bornes en intervalle semi-ouvert [debut, annee suivante) pour rester sur l'index de date
+        annee_suivante = datetime(annee + 1, 1, 1).date()
+        modifies = set()
+        if incremental and datetime.now().date() > fin_annee:
+            # Année écoulée : rien à venir à recalculer, les marquages des autres années sont conservés
+            self.last_stats = {'annee': annee, 'incremental': True, 'matricules': 0, 'lignes': 0,
+                               'duree_totale_s': 0.0, 'lignes_par_seconde': 0.0, 'phases': {}}
+            print(f"Année {annee} écoulée : rien à replanifier en incrémental")
+            return 0
+        try:
+            regles = self.load_rule_matrix()
+            cursor.execute("SELECT matricule, categorie FROM Matricules")
+            matricules = cursor.fetchall()
+            if incremental:
+                # Seules les lignes 'a_faire' à venir des matricules touchés sont recalculées
+                modifies = self.db.load_matricules_modifies(annee)
+                matricules = [m for m in matricules if m[0] in modifies]
+                debut_annee = max(debut_annee, datetime.now().date())
+            dernieres = self.db.load_derniere_intervention()
+            immobilisations = IntervalIndex.from_rows(self.db.load_immobilisations(modifies if incremental else None))
+            self.phase('chargement')
+
+            rows = self.compute_rows(matricules, debut_annee, fin_annee, regles, dernieres, immobilisations)
+            self.phase('calcul')
+            t_calcul = time.perf_counter()
+            if self.progress:
+                self.progress(f"calcul {annee}", len(rows))
+
+            if incremental:
+                cles = [(m[0], debut_annee, annee_suivante) for m in matricules]
+                cursor.executemany("DELETE FROM Planning WHERE matricule = ? AND statut IN ('a_faire', 'annule_curatif') AND date_prevue >= ? AND date_prevue < ?", cles)
+                # Les lignes réalisées/reportées conservées ne sont pas dupliquées
+                conserves = set()
+                for cle in cles:
+                    cursor.execute("SELECT type_intervention, matricule, nom_entretien, date_prevue FROM Planning WHERE matricule = ? AND date_prevue >= ? AND date_prevue < ?", cle)
+                    conserves.update((r[0], r[1], r[2], str(r[3])) for r in cursor.fetchall())
+                rows = [r for r in rows if (r[0], r[1], r[2], str(r[3])) not in conserves]
+            else:
+                cursor.execute("DELETE FROM Planning WHERE date_prevue >= ? AND date_prevue < ?", (debut_annee, annee_suivante))
+            self.phase('suppression')
+            cursor.executemany(PLANNING_INSERT, rows)
+            self.phase('insertion')
+            if incremental:
+                self.db.clear_matricules_modifies(modifies, annee)
+            else:
+                self.db.clear_matricules_modifies_years(annee, annee)
+            sync_id = self.db.log_sync('PLANNING', None, len(rows), f"Planning {annee}{' (incrémental)' if incremental else ''}", self.phases)
+            self.db.bump_generation()
+            conn.commit()
+            self.phase('commit')
+            # Durées complétées une fois le commit mesuré
+            self.db.update_sync_durees(sync_id, self.phases)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        registry.inc('planning_rows_total', len(rows))
+        t_fin = time.perf_counter()
+        if self.progress:
+            self.progress(f"ecriture {annee}", len(rows))
+
+        total_count = len(rows)
+        duree = t_fin - t0
+        self.last_stats = {
+            'annee': annee,
+            'incremental': incremental,
+            'matricules': len(matricules),
+            'lignes': total_count,
+            'duree_calcul_s': round(t_calcul - t0, 4),
+            'duree_ecriture_s': round(t_fin - t_calcul, 4),
+            'duree_totale_s': round(duree, 4),
+            'lignes_par_seconde': round(total_count / duree, 1) if duree > 0 else 0.0,
+            'phases': dict(self.phases),
+        }
+        mode = f" (incrémental, {len(matricules)} matricules)" if incremental else ""
+        print(f"{total_count} entretiens planifiés pour l'année {annee}{mode} "
+              f"({duree:.2f}s, {self.last_stats['lignes_par_seconde']:.0f} lignes/s)")
+        return total_count
+
+    def generate_planning(self, annee_debut: int, annee_fin: int, workers: Optional[int] = None):
+        # Horizon pluriannuel : flotte découpée en lots de matricules calculés dans des processus séparés,
+        # un seul écrivain (ce processus) insère les lots renvoyés dans une transaction unique
+        t0 = time.perf_counter()
+        self.start_phases()
+        conn = self.db.conn
+        cursor = conn.cursor()
+        debut = datetime(annee_debut, 1, 1).date()
+        fin = datetime(annee_fin, 12, 31).date()
+        apres_fin = datetime(annee_fin + 1, 1, 1).date()
+        workers = workers or os.cpu_count() or 1
         total_count = 0
-        entretiens_defaut = [
-            "Niveau d'huile du carter", "Etanchéité de tous les circuits", "Frein", "courroie",
-            "Filtre à huile", "Vidanger le carter moteur", "Filtre à air", "Filtre carburant",
-            "chaine", "soupape", "Graissage général", "moyeu de roue", "pneu", "boite de vitesse",
-            "cardan", "embrayage", "circuit hydraulique", "pompe hydraulique", "Filtre hydraulique",
-            "Réservoir hydraulique", "alternateur", "batterie", "Faisceaux électriques"
-        ]
-        for e in entretiens_defaut:
-            cursor.execute("INSERT OR IGNORE INTO Entretiens_Types (nom) VALUES (?)", (e,))
-            cursor.execute("INSERT OR IGNORE INTO Parametrage (entretien_nom, type_intervention, intervalle_jours) VALUES (?, 'C', 30)", (e,))
-            cursor.execute("INSERT OR IGNORE INTO Parametrage (entretien_nom, type_intervention, intervalle_jours) VALUES (?, 'N', 90)", (e,))
-            cursor.execute("INSERT OR IGNORE INTO Parametrage (entretien_nom, type_intervention, intervalle_jours) VALUES (?, 'CH', 180)", (e,))
-        for mat_row in matricules:
-            mat = dict(mat_row)
-            matricule_id = mat['matricule']
-            categorie = mat['categorie']
-            cursor.execute("SELECT entretien_exclu FROM Exclusions WHERE categorie = ?", (categorie,))
-            exclusions = [row[0].lower() for row in cursor.fetchall()]
-            for entretien in entretiens_defaut:
-                if entretien.lower() in exclusions:
-                    continue
-                cursor.execute("SELECT type_intervention, intervalle_jours FROM Parametrage WHERE entretien_nom = ?", (entretien,))
-                for param in cursor.fetchall():
-                    type_interv, intervalle = param[0], param[1]
-                    derniere_date = datetime(2010, 1, 1).date()
-                    current_date = derniere_date + timedelta(days=intervalle)
-                    while current_date <= fin_annee:
-                        if current_date >= debut_annee:
-                            table = {'C': 'Planning_Controle', 'N': 'Planning_Nettoyage', 'CH': 'Planning_Changement'}[type_interv]
-                            cursor.execute(f"INSERT INTO {table} (matricule, nom_entretien, date_prevue, date_reference, source_reference) VALUES (?, ?, ?, ?, ?)", 
-                                           (matricule_id, entretien, current_date, derniere_date, 'default'))
-                            total_count += 1
-                        current_date += timedelta(days=intervalle)
-        self.db.conn.commit()
-        print(f"{total_count} entretiens planifiés pour l'année {annee}")
+        try:
+            regles = self.load_rule_matrix()
+            dernieres = self.db.load_derniere_intervention()
+            immobilisations = IntervalIndex.from_rows(self.db.load_immobilisations())
+            cursor.execute("SELECT matricule, categorie FROM Matricules ORDER BY matricule")
+            matricules = [tuple(m) for m in cursor.fetchall()]
+
+            # Dernières réalisations regroupées par matricule en une passe, puis découpées par lot
+            dernieres_par_matricule = {}
+            for cle, v in dernieres.items():
+                dernieres_par_matricule.setdefault(cle[0], {})[cle] = v
+            lots = []
+            taille = max(1, -(-len(matricules) // (workers * PLANNING_LOTS_PAR_WORKER)))
+            for i in range(0, len(matricules), taille):
+                lot = matricules[i:i + taille]
+                noms = {m[0] for m in lot}
+                lot_dernieres = {}
+                for nom in noms:
+                    lot_dernieres.update(dernieres_par_matricule.get(nom, ()))
+                lots.append((lot, debut, fin, regles, lot_dernieres, immobilisations.subset(noms),
+                             self.politique_curatif))
+            self.phase('chargement')
+
+            cursor.execute("DELETE FROM Planning WHERE date_prevue >= ? AND date_prevue < ?", (debut, apres_fin))
+            # Index supprimés pendant l'écriture puis reconstruits en une passe triée (même transaction,
+            # les lecteurs WAL continuent de voir l'ancien planning jusqu'au commit)
+            cursor.execute("DROP INDEX IF EXISTS idx_planning_date")
+            cursor.execute("DROP INDEX IF EXISTS idx_planning_matricule")
+            cursor.execute("DROP INDEX IF EXISTS idx_planning_statut")
+            self.phase('suppression')
+            sql = PLANNING_INSERT
+            # Calcul (processus du pool) et insertion entrelacés : l'insertion est chronométrée à part,
+            # la phase 'calcul' correspond au temps restant, c'est-à-dire à l'attente des lots
+            duree_insertion = 0.0
+            t_boucle = time.perf_counter()
+
+            def inserer(rows):
+                nonlocal total_count, duree_insertion
+                t = time.perf_counter()
+                cursor.executemany(sql, rows)
+                duree_insertion += time.perf_counter() - t
+                total_count += len(rows)
+                if self.progress:
+                    self.progress(f"horizon {annee_debut}-{annee_fin}", total_count)
+
+            if workers > 1 and len(matricules) >= PLANNING_PARALLEL_MIN_MATRICULES:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    for rows in executor.map(planifier_lot, lots):
+                        inserer(rows)
+            else:
+                for lot in lots:
+                    inserer(planifier_lot(lot))
+            self.phase('calcul', time.perf_counter() - t_boucle - duree_insertion)
+            self.phase('insertion', duree_insertion)
+            self.t_phase = time.perf_counter()
+            for idx in PLANNING_INDEXES:
+                cursor.execute(idx)
+            self.phase('index')
+            self.db.clear_matricules_modifies_years(annee_debut, annee_fin)
+            sync_id = self.db.log_sync('PLANNING', None, total_count, f"Planning {annee_debut}-{annee_fin}", self.phases)
+            self.db.bump_generation()
+            conn.commit()
+            self.phase('commit')
+            # Durées complétées une fois le commit mesuré
+            self.db.update_sync_durees(sync_id, self.phases)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        registry.inc('planning_rows_total', total_count)
+        duree = time.perf_counter() - t0
+        self.last_stats = {
+            'annee_debut': annee_debut,
+            'annee_fin': annee_fin,
+            'workers': workers,
+            'lots': len(lots),
+            'matricules': len(matricules),
+            'lignes': total_count,
+            'duree_totale_s': round(duree, 4),
+            'lignes_par_seconde': round(total_count / duree, 1) if duree > 0 else 0.0,
+            'phases': dict(self.phases),
+        }
+        print(f"{total_count} entretiens planifiés pour {annee_debut}-{annee_fin} "
+              f"({len(lots)} lots, {workers} processus, {duree:.2f}s, {self.last_stats['lignes_par_seconde']:.0f} lignes/s)")
         return total_count
 
+
+def planifier_lot(lot) -> list:
+    # Exécuté dans un processus du pool : lignes prêtes pour executemany (dates déjà sérialisées)
+    matricules, debut, fin, regles, dernieres, immobilisations, politique = lot
+    generator = PlanningGenerator(None)
+    generator.politique_curatif = politique
+    rows = generator.compute_rows(matricules, debut, fin, regles, dernieres, immobilisations)
+    return [(t, m, e, d.isoformat(), ref.isoformat(), source, statut, obs) for t, m, e, d, ref, source, statut, obs in rows]
+
 # =============================================================================
 # 4. MAIN
 # =============================================================================
-def main():
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def run_import(db: Database, data_dir: str = DATA_DIR, incremental: bool = True, progress=None) -> dict:
+    importer = DataImporter(db, progress=progress)
+    importer.initialize_exclusions()
+    resultats = {
+        'matrice': importer.import_matrice(os.path.join(data_dir, "MATRICE.csv")),
+        'vidange': importer.import_vidange(os.path.join(data_dir, "VIDANGE.csv"), incremental=incremental),
+        'curatif': importer.import_suivi_curatif(os.path.join(data_dir, "SUIVI_CURATIF.csv"), incremental=incremental),
+    }
+    resultats['matricules_modifies'] = len(importer.matricules_modifies)
+    resultats['stats'] = importer.last_stats
+    return resultats
+
+def run_planning(db: Database, annee: int, incremental: bool = False, progress=None, annee_fin: Optional[int] = None) -> dict:
+    generator = PlanningGenerator(db, progress=progress)
+    if annee_fin and annee_fin > annee and not incremental:
+        generator.generate_planning(annee, annee_fin)
+    elif incremental:
+        # Chaque année garde ses propres marquages : toutes les années demandées sont recalculées
+        stats = {}
+        for annee_courante in range(annee, max(annee, annee_fin or annee) + 1):
+            generator.generate_planning_for_year(annee_courante, incremental=True)
+            stats[str(annee_courante)] = generator.last_stats
+        return {'incremental': True, 'lignes': sum(st['lignes'] for st in stats.values()), 'annees': stats}
+    else:
+        generator.generate_planning_for_year(annee)
+    return generator.last_stats
+
+def main(annee: int = 2025, annee_fin: Optional[int] = None):
     print("Système de Gestion d'Entretiens - Initialisation")
     print("=" * 60)
     db = Database("maintenance.db")
     db.connect()
     db.initialize_schema()
-    importer = DataImporter(db)
-    print("\nInitialisation des exclusions...")
-    importer.initialize_exclusions()
     print("\nImport des données...")
-    importer.import_matrice("backend/data/MATRICE.csv")
-    importer.import_vidange("backend/data/VIDANGE.csv", incremental=True)
-    importer.import_suivi_curatif("dackend/data/SUIVI_CURATIF.csv", incremental=True)
-    print("\nGénération du planning 2025...")
-    PlanningGenerator(db).generate_planning_for_year(2025)
+    run_import(db)
+    print(f"\nGénération du planning {annee}{f'-{annee_fin}' if annee_fin else ''}...")
+    run_planning(db, annee, annee_fin=annee_fin)
     print("\nInitialisation terminée!")
     print("Base de données: maintenance.db")
     db.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2025,
+         int(sys.argv[2]) if len(sys.argv) > 2 else None)
\ No newline at end of file
@@ -0,0 +1,116 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# =============================================================================
+# Compteurs et histogrammes en mémoire, exposés au format texte Prometheus
+# =============================================================================
+# Bornes en secondes : de la requête SQL indexée (ms) à l'import complet (minutes)
+BUCKETS_DEFAUT = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+DESCRIPTIONS = {
+    'import_stage_seconds': ('histogram', "Durée des étapes d'import par fichier (parse, transform, insert, ...)"),
+    'import_rows_total': ('counter', "Lignes insérées par les imports"),
+    'planning_phase_seconds': ('histogram', "Durée des phases de planification"),
+    'planning_rows_total': ('counter', "Lignes de planning écrites"),
+    'sqlite_statement_seconds': ('histogram', "Durée d'exécution des requêtes SQLite par verbe"),
+    'sqlite_batch_seconds': ('histogram', "Durée des executemany SQLite (lot complet) par verbe"),
+    'sqlite_slow_queries_total': ('counter', "Requêtes SQLite au-dessus du seuil de lenteur"),
+    'sqlite_statements_traced_total': ('counter', "Instructions vues par le hook de trace SQLite"),
+    'http_request_seconds': ('histogram', "Durée des requêtes HTTP par route"),
+    'http_requests_total': ('counter', "Requêtes HTTP par route et code de retour"),
+}
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    echappe = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, echappe)) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS_DEFAUT):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, valeur: float):
+        i = bisect.bisect_left(self.buckets, valeur)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.total += valeur
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, nom: str, valeur: float = 1.0, **labels):
+        cle = (nom, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[cle] = self.counters.get(cle, 0.0) + valeur
+
+    def set_gauge(self, nom: str, valeur: float, **labels):
+        with self.lock:
+            self.gauges[(nom, tuple(sorted(labels.items())))] = valeur
+
+    def observe(self, nom: str, valeur: float, **labels):
+        cle = (nom, tuple(sorted(labels.items())))
+        with self.lock:
+            histogramme = self.histograms.get(cle)
+            if histogramme is None:
+                histogramme = self.histograms[cle] = Histogram()
+            histogramme.observe(valeur)
+
+    @contextmanager
+    def timer(self, nom: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(nom, time.perf_counter() - t0, **labels)
+
+    def render(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(
+                (cle, (h.buckets, list(h.counts), h.total, h.count)) for cle, h in self.histograms.items()
+            )
+        lignes = []
+        deja = set()
+
+        def entete(nom: str, type_defaut: str):
+            if nom in deja:
+                return
+            deja.add(nom)
+            type_metrique, aide = DESCRIPTIONS.get(nom, (type_defaut, nom))
+            lignes.append(f"# HELP {nom} {aide}")
+            lignes.append(f"# TYPE {nom} {type_metrique}")
+
+        for (nom, labels), valeur in counters:
+            entete(nom, 'counter')
+            lignes.append(f"{nom}{format_labels(labels)} {valeur:g}")
+        for (nom, labels), valeur in gauges:
+            entete(nom, 'gauge')
+            lignes.append(f"{nom}{format_labels(labels)} {valeur:g}")
+        for (nom, labels), (buckets, counts, total, count) in histograms:
+            entete(nom, 'histogram')
+            cumul = 0
+            for borne, n in zip(buckets, counts):
+                cumul += n
+                lignes.append(f"{nom}_bucket{format_labels(labels + (('le', f'{borne:g}'),))} {cumul}")
+            lignes.append(f"{nom}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lignes.append(f"{nom}_sum{format_labels(labels)} {total:.6f}")
+            lignes.append(f"{nom}_count{format_labels(labels)} {count}")
+        return '\n'.join(lignes) + '\n'
+
+
+registry = MetricsRegistry()
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import {
   Container, Typography, Table, TableBody, TableCell, TableContainer,
@@ -13,61 +13,115 @@ interface PlanningItem {
   nom_entretien: string;
   date_prevue: string;
   statut: string;
+  observations: string | null;
 }
 
+interface PlanningPage {
+  items: PlanningItem[];
+  total: number | null;
+  next_cursor: string | null;
+}
+
+const ANNEE = 2025;
+const PAGE_SIZE = 500;
+const ROW_HEIGHT = 37;
+const VIEWPORT_HEIGHT = 640;
+const OVERSCAN = 10;
+
+const STATUTS: Record<string, { label: string; color: 'success' | 'default' | 'error' | 'warning' }> = {
+  a_faire: { label: 'À faire', color: 'default' },
+  realise: { label: 'Réalisé', color: 'success' },
+  annule_curatif: { label: 'Annulé (curatif)', color: 'error' },
+  reporte: { label: 'Reporté', color: 'warning' },
+};
+
 function App() {
-  const [planning, setPlanning] = useState<PlanningItem[]>([]);
-  const [filtered, setFiltered] = useState<PlanningItem[]>([]);
+  const [items, setItems] = useState<PlanningItem[]>([]);
+  const [total, setTotal] = useState(0);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState('');
+  const [matriculeInput, setMatriculeInput] = useState('');
   const [matriculeFilter, setMatriculeFilter] = useState('');
   const [typeFilter, setTypeFilter] = useState('all');
   const [statutFilter, setStatutFilter] = useState('all');
+  const [scrollTop, setScrollTop] = useState(0);
+  const scrollRef = useRef<HTMLDivElement>(null);
+  // Ignore les réponses d'une requête rendue obsolète par un changement de filtre
+  const requestId = useRef(0);
+
+  const fetchPage = useCallback(async (cursor: string | null) => {
+    const id = cursor ? requestId.current : ++requestId.current;
+    const params: Record<string, string | number> = {
+      from: `${ANNEE}-01-01`,
+      to: `${ANNEE + 1}-01-01`,
+      limit: PAGE_SIZE,
+    };
+    if (matriculeFilter) params.matricule = matriculeFilter;
+    if (typeFilter !== 'all') params.type = typeFilter;
+    if (statutFilter !== 'all') params.statut = statutFilter;
+    if (cursor) params.cursor = cursor;
 
-  const fetchPlanning = async () => {
-    setLoading(true);
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     try {
-      const res = await axios.get('/api/planning/2025');
-      setPlanning(res.data);
-      setFiltered(res.data);
+      const res = await axios.get<PlanningPage>('/api/planning', { params });
+      if (id !== requestId.current) return;
+      if (cursor) {
+        setItems(prev => [...prev, ...res.data.items]);
+      } else {
+        setItems(res.data.items);
+        setTotal(res.data.total ?? 0);
+        setScrollTop(0);
+        if (scrollRef.current) scrollRef.current.scrollTop = 0;
+      }
+      setNextCursor(res.data.next_cursor);
       setError('');
     } catch (err) {
+      if (id !== requestId.current) return;
       setError("Impossible de charger le planning. L'API Flask est-elle lancée ?");
     } finally {
-      setLoading(false);
+      if (id === requestId.current) {
+        setLoading(false);
+        setLoadingMore(false);
+      }
     }
-  };
+  }, [matriculeFilter, typeFilter, statutFilter]);
 
   useEffect(() => {
-    fetchPlanning();
-  }, []);
+    fetchPage(null);
+  }, [fetchPage]);
 
   useEffect(() => {
-    let filteredData = planning;
+    const timer = setTimeout(() => setMatriculeFilter(matriculeInput.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [matriculeInput]);
 
-    if (matriculeFilter) {
-      filteredData = filteredData.filter(p => p.matricule.toLowerCase().includes(matriculeFilter.toLowerCase()));
-    }
-    if (typeFilter !== 'all') {
-      filteredData = filteredData.filter(p => p.type === typeFilter);
-    }
-    if (statutFilter !== 'all') {
-      filteredData = filteredData.filter(p => p.statut === statutFilter);
-    }
+  // Fenêtre de rendu : seules les lignes visibles (plus une marge) sont montées dans le DOM
+  const start = Math.max(0, Math.floor(scrollTop / ROW_HEIGHT) - OVERSCAN);
+  const end = Math.min(items.length, Math.ceil((scrollTop + VIEWPORT_HEIGHT) / ROW_HEIGHT) + OVERSCAN);
+  const visible = items.slice(start, end);
 
-    setFiltered(filteredData);
-  }, [matriculeFilter, typeFilter, statutFilter, planning]);
+  useEffect(() => {
+    if (nextCursor && !loadingMore && end >= items.length - OVERSCAN) {
+      fetchPage(nextCursor);
+    }
+  }, [end, items.length, nextCursor, loadingMore, fetchPage]);
 
-  if (loading) return <Box display="flex" justifyContent="center" mt={10}><CircularProgress /></Box>;
+  if (loading && items.length === 0) return <Box display="flex" justifyContent="center" mt={10}><CircularProgress /></Box>;
   if (error) return <Container><Alert severity="error" sx={{ mt: 4 }}>{error}</Alert></Container>;
 
   return (
     <Container maxWidth="xl" sx={{ mt: 4, mb: 4 }}>
       <Box display="flex" justifyContent="space-between" alignItems="center" mb={3}>
         <Typography variant="h3" component="h1">
-          Planning Entretiens 2025
+          Planning Entretiens {ANNEE}
         </Typography>
-        <Button variant="contained" startIcon={<RefreshIcon />} onClick={fetchPlanning}>
+        <Button variant="contained" startIcon={<RefreshIcon />} onClick={() => fetchPage(null)}>
           Actualiser
         </Button>
       </Box>
@@ -77,8 +131,8 @@ function App() {
           label="Filtrer par matricule"
           variant="outlined"
           size="small"
-          value={matriculeFilter}
-          onChange={(e) => setMatriculeFilter(e.target.value)}
+          value={matriculeInput}
+          onChange={(e) => setMatriculeInput(e.target.value)}
           sx={{ minWidth: 200 }}
         />
         <FormControl size="small" sx={{ minWidth: 150 }}>
@@ -96,11 +150,18 @@ function App() {
             <MenuItem value="all">Tous</MenuItem>
             <MenuItem value="a_faire">À faire</MenuItem>
             <MenuItem value="realise">Réalisé</MenuItem>
+            <MenuItem value="annule_curatif">Annulé (curatif)</MenuItem>
           </Select>
         </FormControl>
       </Box>
 
-      <TableContainer component={Paper} elevation={3}>
+      <TableContainer
+        component={Paper}
+        elevation={3}
+        ref={scrollRef}
+        onScroll={(e: React.UIEvent<HTMLDivElement>) => setScrollTop(e.currentTarget.scrollTop)}
+        sx={{ height: VIEWPORT_HEIGHT }}
+      >
         <Table stickyHeader size="small">
           <TableHead>
             <TableRow sx={{ backgroundColor: '#f5f5f5' }}>
@@ -112,8 +173,9 @@ function App() {
             </TableRow>
           </TableHead>
           <TableBody>
-            {(filtered ?? []).map((item, i) => (
-              <TableRow key={i} hover>
+            {start > 0 && <TableRow style={{ height: start * ROW_HEIGHT }} />}
+            {visible.map((item, i) => (
+              <TableRow key={start + i} hover sx={{ height: ROW_HEIGHT }}>
                 <TableCell>{item.date_prevue}</TableCell>
                 <TableCell>{item.matricule}</TableCell>
                 <TableCell>{item.nom_entretien}</TableCell>
@@ -129,24 +191,27 @@ function App() {
                 </TableCell>
                 <TableCell>
                   <Chip
-                    label={item.statut === 'realise' ? 'Réalisé' : 'À faire'}
+                    label={(STATUTS[item.statut] ?? STATUTS.a_faire).label}
                     size="small"
-                    color={item.statut === 'realise' ? 'success' : 'default'}
+                    color={(STATUTS[item.statut] ?? STATUTS.a_faire).color}
+                    title={item.observations ?? undefined}
                   />
                 </TableCell>
               </TableRow>
             ))}
+            {end < items.length && <TableRow style={{ height: (items.length - end) * ROW_HEIGHT }} />}
           </TableBody>
         </Table>
       </TableContainer>
 
       <Box mt={2} textAlign="center">
         <Typography variant="body2" color="text.secondary">
-          {filtered.length} / {planning.length} entretiens affichés
+          {items.length} / {total} entretiens chargés
+          {loadingMore && ' — chargement…'}
         </Typography>
       </Box>
     </Container>
   );
 }
 
-export default App;
\ No newline at end of file
+export default App;